@@ -0,0 +1,40 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='background')
+    return _executor
+
+
+def _run(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background task %s failed', func.__name__)
+    finally:
+        # worker threads get their own connections, don't leave them open
+        connections.close_all()
+
+
+def run_in_background(func, *args):
+    """
+    Run `func(*args)` on the shared worker pool once the current transaction
+    commits, so the task always sees the rows the request wrote. Runs inline
+    when BACKGROUND_TASKS_EAGER is set (tests, one-off scripts).
+    """
+    def submit():
+        if settings.BACKGROUND_TASKS_EAGER:
+            func(*args)
+        else:
+            get_executor().submit(_run, func, args)
+
+    transaction.on_commit(submit)
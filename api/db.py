@@ -0,0 +1,124 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_KEY = 'db:pinned:{}'
+
+# where reads go for the request being handled; None (the default outside
+# ReplicaReadsMixin views, in commands and background tasks) is the primary
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def read_alias():
+    return _read_alias.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def read_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def get_pin_cache():
+    return caches[settings.DATABASE_REPLICA_PIN_CACHE]
+
+
+def pin_to_primary(user_id):
+    """Send this user's reads to the primary until replicas have caught up with their write."""
+    get_pin_cache().set(PIN_KEY.format(user_id), True, settings.DATABASE_REPLICA_PIN_TTL.total_seconds())
+
+
+def is_pinned(user_id):
+    return get_pin_cache().get(PIN_KEY.format(user_id)) is not None
+
+
+class ReplicaRouter:
+    """
+    Reads go wherever the current request was routed (see ReplicaReadsMixin),
+    writes always go to the primary. Replicas hold the same rows, so relations
+    between objects loaded from any of them are fine.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaReadsMixin:
+    """
+    Serves GET/HEAD/OPTIONS from a read replica when `replica_reads` is set on
+    the viewset (or passed to `@action`). Any other method pins the user to the
+    primary for DATABASE_REPLICA_PIN_TTL, so they read their own writes on every
+    viewset, not only the one they wrote through.
+    """
+    replica_reads = False
+
+    def dispatch(self, request, *args, **kwargs):
+        with read_from(None):
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        _read_alias.set(self.get_read_alias(request))
+
+    def get_read_alias(self, request):
+        user_id = request.user.pk if request.user.is_authenticated else None
+        if request.method not in SAFE_METHODS:
+            if user_id is not None:
+                pin_to_primary(user_id)
+            return None
+        if not self.replica_reads or not settings.DATABASE_REPLICAS:
+            return None
+        if user_id is not None and is_pinned(user_id):
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def statement_timeout(milliseconds, using=DEFAULT_DB_ALIAS):
+    """
+    Cap every query in the block at `milliseconds`. Uses SET LOCAL inside a
+    transaction, so the limit can't leak onto a pooled or PgBouncer-shared
+    connection. No-op off PostgreSQL or when `milliseconds` is None.
+    """
+    connection = connections[using]
+    if milliseconds is None or connection.vendor != 'postgresql':
+        yield
+        return
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [str(milliseconds)])
+        yield
+
+
+class StatementTimeoutMixin:
+    """
+    Per-endpoint statement timeout (ms) for `list` and `retrieve`; everything
+    else runs under the connection default (DB_STATEMENT_TIMEOUT). Put it after
+    CachedResponseMixin in the bases so cache hits and 304s don't open a
+    transaction just to set it.
+    """
+    statement_timeout = None
+
+    def list(self, request, *args, **kwargs):
+        with statement_timeout(self.statement_timeout, read_alias()):
+            return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        with statement_timeout(self.statement_timeout, read_alias()):
+            return super().retrieve(request, *args, **kwargs)
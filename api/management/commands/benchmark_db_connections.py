@@ -0,0 +1,77 @@
+import copy
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure database connection setup per request: a fresh connection per '
+        'request (CONN_MAX_AGE=0, no pool) against the configured DATABASES settings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Simulated requests per run')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        connection = connections[alias]
+        configured = copy.deepcopy(connection.settings_dict)
+
+        per_request = copy.deepcopy(configured)
+        per_request.update(CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False)
+        per_request['OPTIONS'].pop('pool', None)
+
+        connection.close()
+        connection.settings_dict = per_request
+        try:
+            before = self.run(alias, options['requests'])
+        finally:
+            connection.close()
+            connection.settings_dict = configured
+        after = self.run(alias, options['requests'])
+        connection.close()
+
+        self.stdout.write(f'{"":<26}{"connects":>10}{"setup mean":>12}{"setup p95":>12}{"request mean":>14}')
+        for label, result in (('per-request connection', before), ('configured', after)):
+            self.stdout.write(
+                f'{label:<26}{result["connects"]:>10}{result["setup_mean"]:>10.2f}ms'
+                f'{result["setup_p95"]:>10.2f}ms{result["request_mean"]:>12.2f}ms'
+            )
+
+    def run(self, alias, requests):
+        """Drive the request_started/request_finished cycle the handler runs, one query per request."""
+        connection = connections[alias]
+        connects = []
+
+        def count(sender, connection, **kwargs):
+            if connection.alias == alias:
+                connects.append(1)
+
+        connection_created.connect(count)
+        setup, total = [], []
+        try:
+            for _ in range(requests):
+                started = time.perf_counter()
+                request_started.send(sender=self.__class__)
+                connection.ensure_connection()
+                connected = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+                setup.append((connected - started) * 1000)
+                total.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection_created.disconnect(count)
+
+        return {
+            'connects': len(connects),
+            'setup_mean': statistics.fmean(setup),
+            'setup_p95': statistics.quantiles(setup, n=20)[-1] if len(setup) > 1 else setup[0],
+            'request_mean': statistics.fmean(total),
+        }
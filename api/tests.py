@@ -1,3 +1,208 @@
-from django.test import TestCase
+from unittest.mock import patch
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from api.db import statement_timeout
+from order.models import Cart, CartItem, Order, OrderItem
+from product.cache import get_catalog_cache
+from product.models import Category, Product, ProductImage, Review
+from users.models import User
 
-# Create your tests here.
+
+class EndpointQueryCountTests(TestCase):
+    """
+    Every router endpoint in api/urls.py must cost the same number of queries
+    no matter how many rows sit behind it.
+    """
+    sizes = (2, 8)
+
+    def seed(self, size):
+        """A fresh user, product, cart and order history with `size` children each."""
+        tag = f'{size}-{User.objects.count()}'
+        user = User.objects.create_user(email=f'customer{tag}@example.com', first_name='Customer')
+        category = Category.objects.create(name=f'Category {tag}')
+        products = [
+            Product.objects.create(name=f'Product {tag} {i}', description='Item', price=10 + i, stock=100, category=category)
+            for i in range(size)
+        ]
+        product = products[0]
+        for i in range(size):
+            ProductImage.objects.create(product=product, image=f'products/sample_{i}.jpg')
+            reviewer = User.objects.create_user(email=f'reviewer{tag}-{i}@example.com', first_name='Reviewer')
+            Review.objects.create(product=product, user=reviewer, comment='Good', ratings=4)
+
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=item, quantity=1) for item in products])
+        for _ in range(size):
+            order = Order.objects.create(user=user, status=Order.NOT_PAID, total_price=0)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=item, quantity=1, price=item.price, total_price=item.price)
+                for item in products
+            ])
+
+        return {
+            'user': user,
+            'urls': {
+                'products-list': '/api/v1/products/',
+                'products-detail': f'/api/v1/products/{product.pk}/',
+                'categories-list': '/api/v1/categories/',
+                'categories-detail': f'/api/v1/categories/{category.pk}/',
+                'product-review-list': f'/api/v1/products/{product.pk}/reviews/',
+                'product-review-detail': f'/api/v1/products/{product.pk}/reviews/{product.review_set.first().pk}/',
+                'product-image-list': f'/api/v1/products/{product.pk}/images/',
+                'product-image-detail': f'/api/v1/products/{product.pk}/images/{product.images.first().pk}/',
+                'carts-detail': f'/api/v1/carts/{cart.pk}/',
+                'carts-mine': '/api/v1/carts/mine/',
+                'cart-item-list': f'/api/v1/carts/{cart.pk}/items/',
+                'cart-item-detail': f'/api/v1/carts/{cart.pk}/items/{cart.items.first().pk}/',
+                'orders-list': '/api/v1/orders/',
+                'orders-detail': f'/api/v1/orders/{order.pk}/',
+            },
+        }
+
+    def count_queries(self, url, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        get_catalog_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_query_count_is_independent_of_data_size(self):
+        staff = User.objects.create_user(email='staff@example.com', is_staff=True)
+        counts = {}
+        for size in self.sizes:
+            seeded = self.seed(size)
+            for name, url in seeded['urls'].items():
+                counts.setdefault(name, []).append(self.count_queries(url, seeded['user']))
+            counts.setdefault('orders-list (staff)', []).append(self.count_queries('/api/v1/orders/', staff))
+
+        for name, per_size in counts.items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(len(set(per_size)), 1, f'{name}: {dict(zip(self.sizes, per_size))}')
+
+
+class StatementTimeoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(name='Runner', description='Shoe', price=50, stock=10, category=category)
+        cls.staff = User.objects.create_user(email='staff@example.com', is_staff=True)
+
+    def setUp(self):
+        get_catalog_cache().clear()
+
+    def test_only_reads_that_reach_the_database_set_the_timeout(self):
+        client = APIClient()
+        url = f'/api/v1/products/{self.product.pk}/'
+        with patch('api.db.statement_timeout', wraps=statement_timeout) as timeout:
+            etag = client.get(url)['ETag']
+            self.assertEqual(timeout.call_count, 1)
+            with self.assertNumQueries(0):
+                client.get(url)
+                self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            client.force_authenticate(self.staff)
+            client.patch(url, {'stock': 5}, format='json')
+        self.assertEqual(timeout.call_count, 1)
+
+
+REPLICA = 'replica_test'
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRoutingTests(TestCase):
+    """
+    A second, in-memory SQLite database stands in for the replica. It never
+    gets the rows written here, so a read that finds them went to the primary.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # only these tests see the extra alias: the runner never creates or
+        # checks it, so it's added (and migrated) here and listed in
+        # `databases` only once it exists
+        connections.settings[REPLICA] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            REPLICA: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+        })[REPLICA]
+        cls.addClassCleanup(cls.remove_replica)
+        call_command('migrate', database=REPLICA, verbosity=0)
+        cls.databases = {DEFAULT_DB_ALIAS, REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        product = Product.objects.create(name='Runner', description='Shoe', price=50, stock=10, category=category)
+        cls.user = User.objects.create_user(email='buyer@example.com', first_name='Buyer')
+        cls.other = User.objects.create_user(email='browser@example.com', first_name='Browser')
+        Review.objects.create(product=product, user=cls.other, comment='Good', ratings=5)
+        cls.reviews_url = f'/api/v1/products/{product.pk}/reviews/'
+
+    def setUp(self):
+        get_catalog_cache().clear()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def replica_queries(self, client, url):
+        with CaptureQueriesContext(connections[REPLICA]) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries), response
+
+    def test_catalog_reads_go_to_the_replica(self):
+        count, response = self.replica_queries(self.client_for(self.user), self.reviews_url)
+        self.assertGreater(count, 0)
+        self.assertEqual(response.data['results'], [])
+
+    def test_writer_reads_from_primary_until_the_pin_expires(self):
+        client = self.client_for(self.user)
+        self.assertEqual(client.post('/api/v1/carts/').status_code, 201)
+
+        count, response = self.replica_queries(client, self.reviews_url)
+        self.assertEqual(count, 0)
+        self.assertEqual(len(response.data['results']), 1)
+
+        count, _ = self.replica_queries(self.client_for(self.other), self.reviews_url)
+        self.assertGreater(count, 0)
+
+        get_catalog_cache().clear()
+        count, _ = self.replica_queries(client, self.reviews_url)
+        self.assertGreater(count, 0)
+
+    def test_viewsets_without_replica_reads_use_the_primary(self):
+        count, _ = self.replica_queries(self.client_for(self.user), '/api/v1/orders/')
+        self.assertEqual(count, 0)
+
+
+@override_settings(CRON_SECRET='cron-secret')
+class CronJobTests(TestCase):
+    def run_job(self, job, secret='cron-secret'):
+        return APIClient().get(f'/api/v1/cron/{job}/', HTTP_AUTHORIZATION=f'Bearer {secret}')
+
+    def test_runs_the_sweep_command(self):
+        response = self.run_job('process-payment-callbacks')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['output'], 'Processed 0 payment callbacks')
+
+    def test_needs_the_cron_secret(self):
+        self.assertEqual(self.run_job('process-payment-callbacks', secret='guess').status_code, 403)
+        self.assertEqual(APIClient().get('/api/v1/cron/process-payment-callbacks/').status_code, 403)
+        with self.settings(CRON_SECRET=''):
+            self.assertEqual(self.run_job('process-payment-callbacks', secret='').status_code, 403)
+
+    def test_unknown_job_is_a_404(self):
+        self.assertEqual(self.run_job('migrate').status_code, 404)
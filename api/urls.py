@@ -2,7 +2,8 @@ from django.urls import path ,include
 from rest_framework.routers import DefaultRouter
 from product.views import ProductViewSet , CategoryViewSet, ProductImageViewSet, ReviewViewSet
 from rest_framework_nested import routers
-from order.views import CartViewSet, CartItemViewSet, OrderViewSet, initiate_payment
+from api.views import run_cron_job
+from order.views import CartViewSet, CartItemViewSet, OrderViewSet, initiate_payment, initiate_payment_async, payment_ipn
 
 router = routers.DefaultRouter()
 router.register('products', ProductViewSet, basename='products')
@@ -23,7 +24,11 @@ urlpatterns = [
     path("", include(cart_router.urls)),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
-    path('initiate/payment/', initiate_payment, name='initiate-payment')
+    path('initiate/payment/', initiate_payment, name='initiate-payment'),
+    # same endpoint for ASGI deployments (phimart/asgi.py); awaits the gateway instead of blocking a thread
+    path('initiate/payment/async/', initiate_payment_async, name='initiate-payment-async'),
+    path('payment/ipn/', payment_ipn, name='payment-ipn'),
+    path('cron/<slug:job>/', run_cron_job, name='cron-job'),
     # if we need to add more url endpoints...we can add
     # path('products/', include('product.product_urls')),
     # path("categories/", include('product.category_urls'))
@@ -1,3 +1,33 @@
-from django.shortcuts import render
+import hmac
+from io import StringIO
+from django.conf import settings
+from django.core.management import call_command
+from rest_framework import status
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
 
-# Create your views here.
+# job in the URL -> management command; scheduled in vercel.json
+CRON_JOBS = {
+    'process-payment-callbacks': 'process_payment_callbacks',
+    'process-product-images': 'process_product_images',
+    'purge-guest-carts': 'purge_guest_carts',
+    'purge-idempotency-keys': 'purge_idempotency_keys',
+}
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def run_cron_job(request, job):
+    """Runs one of CRON_JOBS for Vercel Cron, which authenticates with the CRON_SECRET bearer token."""
+    secret = settings.CRON_SECRET
+    authorization = request.headers.get('Authorization', '')
+    if not secret or not hmac.compare_digest(authorization.encode('utf-8'), f'Bearer {secret}'.encode('utf-8')):
+        return Response({'Error': 'Invalid cron secret'}, status=status.HTTP_403_FORBIDDEN)
+    command = CRON_JOBS.get(job)
+    if command is None:
+        return Response({'Error': 'Unknown job'}, status=status.HTTP_404_NOT_FOUND)
+    output = StringIO()
+    call_command(command, stdout=output)
+    return Response({'job': job, 'output': output.getvalue().strip()})
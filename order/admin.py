@@ -4,7 +4,7 @@ from order.models import Cart, CartItem, Order, OrderItem
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user']
+    list_display = ['id', 'user', 'expires_at']
 
 
 
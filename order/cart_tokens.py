@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core import signing
+
+CART_TOKEN_HEADER = 'X-Cart-Token'
+CART_TOKEN_SALT = 'order.guest-cart'
+
+
+def make_cart_token(cart_id):
+    return signing.dumps(str(cart_id), salt=CART_TOKEN_SALT, compress=True)
+
+
+def read_cart_token(request):
+    """Cart id from a valid, unexpired X-Cart-Token header, else None."""
+    token = request.headers.get(CART_TOKEN_HEADER)
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=CART_TOKEN_SALT, max_age=settings.GUEST_CART_TTL)
+    except signing.BadSignature:
+        return None
@@ -0,0 +1,42 @@
+import csv
+import json
+from itertools import groupby
+from django.core.serializers.json import DjangoJSONEncoder
+
+ORDER_COLUMNS = ['order_id', 'created_at', 'status', 'customer', 'order_total']
+ITEM_COLUMNS = ['product_id', 'product', 'quantity', 'price', 'total_price']
+# OrderItem lookups, in ORDER_COLUMNS + ITEM_COLUMNS order
+EXPORT_LOOKUPS = [
+    'order_id', 'order__created_at', 'order__status', 'order__user__email', 'order__total_price',
+    'product_id', 'product__name', 'quantity', 'price', 'total_price',
+]
+
+
+class Echo:
+    """csv.writer target that hands each line back instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """One line per order item, order fields repeated."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(rows):
+    """One JSON object per order with its items; rows must arrive grouped by order."""
+    size = len(ORDER_COLUMNS)
+    for order, lines in groupby(rows, key=lambda row: row[:size]):
+        record = dict(zip(ORDER_COLUMNS, order))
+        record['items'] = [dict(zip(ITEM_COLUMNS, line[size:])) for line in lines]
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+}
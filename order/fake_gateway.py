@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from order.payments import ipn_signature
+
+
+class FakeSSLCommerzHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real gateway
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        data = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        time.sleep(self.server.latency)
+
+        if url.path != '/gwprocess/v4/api.php':
+            return self.send_json({'status': 'FAILED', 'failedreason': 'Not found'}, status=404)
+        if (data.get('store_id'), data.get('store_passwd')) != (self.server.store_id, self.server.store_pass):
+            return self.send_json({'status': 'FAILED', 'failedreason': 'Store Credential Error Or Store is De-active'})
+
+        session_key = uuid.uuid4().hex.upper()
+        with self.server.lock:
+            self.server.sessions[data.get('tran_id')] = {'amount': data.get('total_amount'), 'currency': data.get('currency')}
+        self.send_json({
+            'status': 'SUCCESS',
+            'sessionkey': session_key,
+            'GatewayPageURL': f'{self.server.base_url}/gwprocess/v4/gw.php?Q=pay&SESSIONKEY={session_key}',
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        time.sleep(self.server.latency)
+
+        if url.path != '/validator/api/validationserverAPI.php':
+            return self.send_json({'status': 'FAILED', 'failedreason': 'Not found'}, status=404)
+        with self.server.lock:
+            payment = self.server.payments.get(params.get('val_id'))
+        if payment is None:
+            return self.send_json({'status': 'INVALID_TRANSACTION'})
+        self.send_json({**payment, 'status': 'VALID'})
+
+
+class FakeSSLCommerzServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the SSLCommerz session and validation APIs, for tests and
+    offline load tests. Point SSLCOMMERZ_BASE_URL at `base_url`. `pay()` marks a
+    session as paid and returns the val_id the gateway would send back.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, store_id='test_store', store_pass='test_store@ssl', latency=0.0, verbose=False):
+        super().__init__((host, port), FakeSSLCommerzHandler)
+        self.store_id = store_id
+        self.store_pass = store_pass
+        self.latency = latency
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.payments = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def pay(self, tran_id):
+        with self.lock:
+            session = self.sessions[tran_id]
+            val_id = uuid.uuid4().hex
+            self.payments[val_id] = {
+                'val_id': val_id,
+                'tran_id': tran_id,
+                'amount': session['amount'],
+                'currency': session['currency'],
+            }
+        return val_id
+
+    def ipn_payload(self, val_id, status='VALID'):
+        """The signed form the gateway POSTs to the IPN endpoint after `pay()`."""
+        with self.lock:
+            payment = dict(self.payments[val_id])
+        payload = {**payment, 'status': status, 'store_id': self.store_id}
+        payload['verify_key'] = ','.join(sorted(payload))
+        payload['verify_sign'] = ipn_signature(payload, self.store_pass)
+        return payload
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,10 @@
+from django_filters.rest_framework import FilterSet
+from order.models import Order
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            'status' : ['exact'],
+            'created_at' : ['gte', 'lte'],
+        }
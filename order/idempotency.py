@@ -0,0 +1,131 @@
+import hashlib
+import json
+import time
+from functools import wraps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from order.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+POLL_INTERVAL = 0.25  # seconds between looks at a claim another request holds
+IN_PROGRESS = object()
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode('utf-8')).hexdigest()
+
+
+def claim_key(request):
+    """
+    Claim the request's Idempotency-Key before its view runs. Returns
+    (response, None) when the view must not run (replay, conflict, bad key)
+    and (None, claim) when it should; `claim` is None for requests that
+    carry no key. Pass the claim to `release_key` or `store_response`.
+
+    A duplicate of a request still running polls for up to IDEMPOTENCY_WAIT
+    and then gets the stored response, or the key if the first request
+    failed; only after that does it get 409.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key or not request.user.is_authenticated:
+        return None, None
+    if len(key) > 255:
+        return Response({'detail': f'{IDEMPOTENCY_HEADER} must be at most 255 characters'}, status=status.HTTP_400_BAD_REQUEST), None
+
+    fingerprint = request_fingerprint(request)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT.total_seconds()
+    while True:
+        response, claim = try_claim(request.user, key, fingerprint)
+        if response is not IN_PROGRESS:
+            return response, claim
+        if time.monotonic() >= deadline:
+            return Response(
+                {'detail': f'A request with this {IDEMPOTENCY_HEADER} is still in progress'},
+                status=status.HTTP_409_CONFLICT,
+            ), None
+        time.sleep(POLL_INTERVAL)
+
+
+def try_claim(user, key, fingerprint):
+    now = timezone.now()
+    expires_at = now + settings.IDEMPOTENCY_KEY_TTL
+    with transaction.atomic():
+        record, created = IdempotencyKey.objects.select_for_update().get_or_create(
+            user=user, key=key, defaults={'fingerprint': fingerprint, 'expires_at': expires_at, 'claimed_at': now}
+        )
+        if not created and record.expires_at <= now:
+            record.fingerprint, record.status_code, record.response = fingerprint, None, None
+            record.expires_at, record.claimed_at = expires_at, now
+            record.save()
+            created = True
+
+        if not created:
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {'detail': f'{IDEMPOTENCY_HEADER} was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                ), None
+            if record.status_code is not None:
+                return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'}), None
+            abandoned = record.claimed_at is None or record.claimed_at <= now - settings.IDEMPOTENCY_CLAIM_TIMEOUT
+            if not abandoned:
+                return IN_PROGRESS, None
+            # its worker was killed mid-request (e.g. a serverless timeout); run the view again
+            record.claimed_at = now
+            record.save(update_fields=['claimed_at'])
+
+    # filtered on claimed_at too, so a worker whose claim was taken over can't store or release it
+    return None, IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True, claimed_at=record.claimed_at)
+
+
+def release_key(claim):
+    """Give the key back, so the client may retry with it."""
+    if claim is not None:
+        claim.delete()
+
+
+def store_response(claim, response):
+    """Keep the response for replays, or release the key after a 5xx."""
+    if claim is None:
+        return
+    if response.status_code >= 500:
+        claim.delete()
+        return
+    # stored as it is rendered, so a replay is byte-for-byte the same JSON
+    claim.update(status_code=response.status_code, response=json.loads(json.dumps(response.data, cls=JSONEncoder)))
+
+
+def idempotent(view):
+    """
+    Replays the stored response when an authenticated client retries a POST
+    with the same Idempotency-Key, instead of running the view again.
+
+    The key is claimed (inserted as in progress) and committed before the
+    view runs, so no lock or transaction is held while the view waits on
+    the database or the payment gateway. A duplicate arriving meanwhile waits
+    for that response (see `claim_key`); once stored it is replayed. If the
+    view raises or answers 5xx, the claim is released and the client may
+    retry with the same key.
+    Works on viewset methods and on @api_view functions.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        request = args[0] if isinstance(args[0], Request) else args[1]
+        response, claim = claim_key(request)
+        if response is not None:
+            return response
+        try:
+            response = view(*args, **kwargs)
+        except Exception:
+            release_key(claim)
+            raise
+        store_response(claim, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from order.models import PaymentCallback
+from order.tasks import process_payment_callback
+
+
+class Command(BaseCommand):
+    help = 'Validate payment callbacks that are still pending (gateway errors, restarted workers)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stuck-after', type=int, default=10, help='Minutes before a processing callback is retried')
+
+    def handle(self, *args, **options):
+        stuck = timezone.now() - timedelta(minutes=options['stuck_after'])
+        PaymentCallback.objects.filter(status=PaymentCallback.PROCESSING, updated_at__lt=stuck).update(
+            status=PaymentCallback.PENDING
+        )
+        pending = PaymentCallback.objects.filter(status=PaymentCallback.PENDING).values_list('pk', flat=True)
+        processed = 0
+        for callback_id in pending.iterator():
+            process_payment_callback(callback_id)
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} payment callbacks'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from order.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Delete guest carts whose token has expired, with their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = Cart.objects.filter(user__isnull=True, expires_at__lte=timezone.now())
+        deleted = 0
+        while True:
+            batch = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += Cart.objects.filter(pk__in=batch).delete()[1].get(Cart._meta.label, 0)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired guest carts'))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from order.fake_gateway import FakeSSLCommerzServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake SSLCommerz gateway (set SSLCOMMERZ_BASE_URL to its address)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before every response')
+        parser.add_argument('--verbose', action='store_true')
+
+    def handle(self, *args, **options):
+        server = FakeSSLCommerzServer(
+            host=options['host'],
+            port=options['port'],
+            store_id=settings.SSLCOMMERZ['STORE_ID'],
+            store_pass=settings.SSLCOMMERZ['STORE_PASS'],
+            latency=options['latency'],
+            verbose=options['verbose'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fake SSLCommerz gateway listening on {server.base_url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
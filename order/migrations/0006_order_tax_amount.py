@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0005_guest_carts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+    ]
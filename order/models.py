@@ -1,23 +1,217 @@
-from django.db import models
+from django.db import connections, models, router, transaction, IntegrityError
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from users.models import User
 from product.models import Product
+from product.pricing import tax_rate
 from uuid import uuid4
+from decimal import Decimal
+from django.utils import timezone
+
+
+def line_total():
+    """price x quantity of a cart line, computed by the database."""
+    return ExpressionWrapper(F('product__price') * F('quantity'), output_field=DecimalField(max_digits=20, decimal_places=2))
+
+
+def write_connection(queryset):
+    """
+    Connection for hand-written INSERTs: the primary, even when the request
+    routes reads (and so `queryset.db`) to a replica.
+    """
+    return connections[queryset._db or router.db_for_write(queryset.model, **queryset._hints)]
+
+
+class CartQuerySet(models.QuerySet):
+    def with_total(self):
+        totals = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart').annotate(
+            total=Sum(line_total())
+        ).values('total')
+        return self.annotate(
+            total_price=Coalesce(Subquery(totals), Value(Decimal('0')), output_field=DecimalField(max_digits=20, decimal_places=2))
+        )
+
+    def get_or_create_for_user(self, user):
+        """
+        The id of the user's cart, creating it if needed, as one atomic
+        INSERT ... ON CONFLICT (user_id) upsert. Returns (cart_id, created).
+        """
+        connection = write_connection(self)
+        if not (connection.features.supports_update_conflicts_with_target and connection.features.can_return_columns_from_insert):
+            cart, created = self.using(connection.alias).get_or_create(user=user)
+            return cart.pk, created
+
+        meta = self.model._meta
+        qn = connection.ops.quote_name
+        new_id = uuid4()
+        sql = (
+            f'INSERT INTO {qn(meta.db_table)} ({qn("id")}, {qn("user_id")}, {qn("created_at")}) VALUES (%s, %s, %s) '
+            f'ON CONFLICT ({qn("user_id")}) DO UPDATE SET {qn("user_id")} = EXCLUDED.{qn("user_id")} '
+            f'RETURNING {qn("id")}'
+        )
+        params = [
+            meta.pk.get_db_prep_value(new_id, connection),
+            user.pk,
+            meta.get_field('created_at').get_db_prep_value(timezone.now(), connection),
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            cart_id = meta.pk.to_python(cursor.fetchone()[0])
+        return cart_id, cart_id == new_id
+
+    def guests(self):
+        return self.filter(user__isnull=True, expires_at__gt=timezone.now())
+
+    def with_items(self):
+        """Cart total plus its lines, products, line totals and tax rates, in two queries."""
+        items = CartItem.objects.select_related('product').with_line_total().annotate(tax_rate=tax_rate('product__category'))
+        return self.with_total().prefetch_related(Prefetch('items', queryset=items))
+
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)  # guest carts only
+
+    objects = CartQuerySet.as_manager()
 
     def __str__(self):
+        if self.user_id is None:
+            return f'Guest cart {self.id}'
         return f'Cart of {self.user.first_name}'
 
 
+class CartItemQuerySet(models.QuerySet):
+    def with_line_total(self):
+        return self.annotate(line_total=line_total())
+
+    def total(self):
+        return self.aggregate(
+            total=Coalesce(Sum(line_total()), Value(Decimal('0')), output_field=DecimalField(max_digits=20, decimal_places=2))
+        )['total']
+
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Add `quantity` of a product to a cart, creating the line or increasing
+        it. Returns the saved CartItem, or None if the product doesn't exist.
+        """
+        connection = write_connection(self)
+        items = self.using(connection.alias)
+        if connection.features.supports_update_conflicts_with_target and connection.features.can_return_columns_from_insert:
+            return items._upsert(connection, cart_id, product_id, quantity)
+
+        # no ON CONFLICT ... RETURNING: update first, insert if nothing was there
+        with transaction.atomic(using=connection.alias):
+            item = items._increment(cart_id, product_id, quantity)
+            if item is None and Product.objects.using(connection.alias).filter(pk=product_id).exists():
+                try:
+                    with transaction.atomic(using=connection.alias):
+                        item = items.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                except IntegrityError:
+                    # a concurrent add inserted the line first
+                    item = items._increment(cart_id, product_id, quantity)
+            return item
+
+    def _upsert(self, connection, cart_id, product_id, quantity):
+        # the SELECT from product both checks the id exists and keeps it one statement
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        sql = (
+            f'INSERT INTO {table} ({qn("cart_id")}, {qn("product_id")}, {qn("quantity")}) '
+            f'SELECT %s, {qn("id")}, %s FROM {qn(Product._meta.db_table)} WHERE {qn("id")} = %s '
+            f'ON CONFLICT ({qn("cart_id")}, {qn("product_id")}) '
+            f'DO UPDATE SET {qn("quantity")} = {table}.{qn("quantity")} + EXCLUDED.{qn("quantity")} '
+            f'RETURNING {qn("id")}, {qn("quantity")}'
+        )
+        cart_value = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [cart_value, quantity, product_id])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return self._existing(row[0], cart_id, product_id, row[1])
+
+    def upsert_quantities(self, cart_id, quantities, increment=False):
+        """
+        Write {product_id: quantity} lines of a cart in one statement, adding
+        to existing lines when `increment` is set and replacing them otherwise.
+        The products must already be known to exist.
+        """
+        if not quantities:
+            return
+        connection = write_connection(self)
+        if not connection.features.supports_update_conflicts_with_target:
+            items = self.using(connection.alias)
+            with transaction.atomic(using=connection.alias):
+                for product_id, quantity in quantities.items():
+                    if increment:
+                        items.add_quantity(cart_id, product_id, quantity)
+                    else:
+                        items.update_or_create(cart_id=cart_id, product_id=product_id, defaults={'quantity': quantity})
+            return
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        new_quantity = f'{table}.{qn("quantity")} + EXCLUDED.{qn("quantity")}' if increment else f'EXCLUDED.{qn("quantity")}'
+        rows = ', '.join(['(%s, %s, %s)'] * len(quantities))
+        sql = (
+            f'INSERT INTO {table} ({qn("cart_id")}, {qn("product_id")}, {qn("quantity")}) VALUES {rows} '
+            f'ON CONFLICT ({qn("cart_id")}, {qn("product_id")}) DO UPDATE SET {qn("quantity")} = {new_quantity}'
+        )
+        cart_value = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        params = []
+        for product_id, quantity in sorted(quantities.items()):
+            params += [cart_value, product_id, quantity]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def merge_cart(self, source_cart_id, target_cart_id):
+        """Add every line of one cart to another with one INSERT ... SELECT upsert."""
+        connection = write_connection(self)
+        if not connection.features.supports_update_conflicts_with_target:
+            items = self.using(connection.alias)
+            quantities = dict(items.filter(cart_id=source_cart_id).values_list('product_id', 'quantity'))
+            return items.upsert_quantities(target_cart_id, quantities, increment=True)
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        columns = f'{qn("cart_id")}, {qn("product_id")}, {qn("quantity")}'
+        sql = (
+            f'INSERT INTO {table} ({columns}) '
+            f'SELECT %s, {qn("product_id")}, {qn("quantity")} FROM {table} WHERE {qn("cart_id")} = %s '
+            f'ON CONFLICT ({qn("cart_id")}, {qn("product_id")}) '
+            f'DO UPDATE SET {qn("quantity")} = {table}.{qn("quantity")} + EXCLUDED.{qn("quantity")}'
+        )
+        cart_field = self.model._meta.get_field('cart')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [
+                cart_field.get_db_prep_value(target_cart_id, connection),
+                cart_field.get_db_prep_value(source_cart_id, connection),
+            ])
+
+    def _increment(self, cart_id, product_id, quantity):
+        lines = self.filter(cart_id=cart_id, product_id=product_id)
+        if not lines.update(quantity=F('quantity') + quantity):
+            return None
+        pk, total = lines.values_list('pk', 'quantity').get()
+        return self._existing(pk, cart_id, product_id, total)
+
+    def _existing(self, pk, cart_id, product_id, quantity):
+        item = self.model(id=pk, cart_id=cart_id, product_id=product_id, quantity=quantity)
+        item._state.adding = False
+        item._state.db = self.db
+        return item
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
@@ -40,14 +234,20 @@ class Order(models.Model):
     ]
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
-    status = models.CharField(max_length=30, choices=STATUS_CHOICES)
+    status = models.CharField(max_length=30, choices=STATUS_CHOICES, default=NOT_PAID)
     total_price = models.DecimalField(max_digits=20, decimal_places=2)
+    tax_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)  # at the rates when ordered
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'Order {self.id} by {self.user.first_name} - {self.status}'
 
+    @property
+    def payable_amount(self):
+        """What the customer pays: the lines plus the tax stored with the order."""
+        return self.total_price + self.tax_amount
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -57,4 +257,49 @@ class OrderItem(models.Model):
     total_price = models.DecimalField(max_digits=12, decimal_places=2)
 
     def __str__(self):
-        return f'{self.quantity} x {self.product.name}'
\ No newline at end of file
+        return f'{self.quantity} x {self.product.name}'
+
+
+class IdempotencyKey(models.Model):
+    """Response of a POST sent with an Idempotency-Key header, replayed on retries until it expires."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # when the request now running under this key started; identifies its claim
+    claimed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} ({self.status_code})'
+
+
+class PaymentCallback(models.Model):
+    """One row per gateway transaction; IPN retries for the same tran_id are dropped."""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    PAID = 'paid'
+    REJECTED = 'rejected'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (PAID, 'Paid'),
+        (REJECTED, 'Rejected'),
+    ]
+    tran_id = models.CharField(max_length=100, unique=True)
+    val_id = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.tran_id} - {self.status}'
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+def ipn_signature(data, store_pass):
+    """md5 over the `verify_key` fields plus md5(store password), sorted by key."""
+    params = {key: data.get(key, '') for key in data.get('verify_key', '').split(',') if key}
+    params['store_passwd'] = hashlib.md5(store_pass.encode('utf-8')).hexdigest()
+    message = '&'.join(f'{key}={params[key]}' for key in sorted(params))
+    return hashlib.md5(message.encode('utf-8')).hexdigest()
+
+
+class SSLCommerzGateway:
+    """
+    SSLCommerz client built on one pooled `requests.Session`, so keep-alive
+    connections to the gateway are reused across requests instead of paying
+    a TCP+TLS handshake per checkout. Connect errors are retried with
+    exponential backoff, and so are 502/503/504 answers to the (read-only)
+    validation GET. A session-create POST that reached the gateway is never
+    retried, since the gateway may have opened the session before failing.
+    """
+    session_path = '/gwprocess/v4/api.php'
+    validation_path = '/validator/api/validationserverAPI.php'
+
+    def __init__(self, store_id, store_pass, base_url, timeout=(3.05, 15), retries=2, backoff=0.5, pool_size=10):
+        self.store_id = store_id
+        self.store_pass = store_pass
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET'}),  # status retries; connect errors retry any method
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def call(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise PaymentGatewayError(str(e)) from e
+
+    def create_session(self, post_body):
+        data = {**post_body, 'store_id': self.store_id, 'store_passwd': self.store_pass}
+        return self.call('POST', self.session_path, data=data)
+
+    def validate(self, val_id):
+        params = {'val_id': val_id, 'store_id': self.store_id, 'store_passwd': self.store_pass, 'format': 'json'}
+        return self.call('GET', self.validation_path, params=params)
+
+    def verify_signature(self, data):
+        if not data.get('verify_key') or not data.get('verify_sign'):
+            return False
+        return hmac.compare_digest(ipn_signature(data, self.store_pass), data['verify_sign'])
+
+
+class AsyncSSLCommerzGateway:
+    """
+    Awaitable wrapper for ASGI code (initiate_payment_async, served through
+    phimart/asgi.py): calls run on a small dedicated thread pool over the
+    same pooled client, so neither the event loop nor Django's
+    thread-sensitive executor is blocked on the gateway.
+    """
+
+    def __init__(self, gateway, max_workers=10):
+        self.gateway = gateway
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='payment-gateway')
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def create_session(self, post_body):
+        return await self.run(self.gateway.create_session, post_body)
+
+    async def validate(self, val_id):
+        return await self.run(self.gateway.validate, val_id)
+
+
+@lru_cache(maxsize=None)
+def get_gateway():
+    config = settings.SSLCOMMERZ
+    return SSLCommerzGateway(
+        store_id=config['STORE_ID'],
+        store_pass=config['STORE_PASS'],
+        base_url=config['BASE_URL'],
+        timeout=(config['CONNECT_TIMEOUT'], config['READ_TIMEOUT']),
+        retries=config['RETRIES'],
+        backoff=config['BACKOFF'],
+        pool_size=config['POOL_SIZE'],
+    )
+
+
+@lru_cache(maxsize=None)
+def get_async_gateway():
+    return AsyncSSLCommerzGateway(get_gateway(), max_workers=settings.SSLCOMMERZ['POOL_SIZE'])
@@ -0,0 +1,17 @@
+from rest_framework import permissions
+from order.models import Cart
+from order.cart_tokens import read_cart_token
+
+
+class IsCartOwner(permissions.BasePermission):
+    """The cart in the URL belongs to the user, or is the guest cart named by their X-Cart-Token."""
+
+    def has_permission(self, request, view):
+        cart_id = view.kwargs.get('cart_pk')
+        if cart_id is None:
+            return True
+        if request.user and request.user.is_authenticated:
+            return Cart.objects.filter(pk=cart_id, user=request.user).exists()
+        if str(cart_id) != read_cart_token(request):
+            return False
+        return Cart.objects.guests().filter(pk=cart_id).exists()
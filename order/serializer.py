@@ -4,6 +4,8 @@ from product.serializer import ProductSerializer
 from product.models import Product
 from order.models import Order, OrderItem
 from order.services import OrderService
+from django.db import transaction
+from product.pricing import price_items
 
 
 # for get to show
@@ -25,19 +27,62 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            self.instance = cart_item.save()
-        except:
-            self.instance = cart_item = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+        self.instance = CartItem.objects.add_quantity(cart_id, product_id, quantity)
+        if self.instance is None:
+            raise serializers.ValidationError({'product_id': [f'Product with this id {product_id} just not exist']})
+        return self.instance
+
+class CartItemOperationSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+
+
+class BulkCartItemSerializer(serializers.Serializer):
+    """
+    Many cart lines in one request. `add` adds to what is in the cart, `set`
+    replaces the quantities and removes lines set to 0.
+    """
+    ADD = 'add'
+    SET = 'set'
+    MAX_ITEMS = 200
+
+    mode = serializers.ChoiceField(choices=[ADD, SET], default=ADD)
+    items = CartItemOperationSerializer(many=True, allow_empty=False, max_length=MAX_ITEMS)
 
+    def validate_items(self, items):
+        product_ids = {item['product_id'] for item in items}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        missing = sorted(product_ids - found)
+        if missing:
+            raise serializers.ValidationError(f'Products with these ids just not exist: {", ".join(map(str, missing))}')
+        return items
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        mode = self.validated_data['mode']
+
+        quantities = {}
+        for item in self.validated_data['items']:
+            if mode == self.ADD:
+                quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+            else:
+                quantities[item['product_id']] = item['quantity']
+
+        with transaction.atomic():
+            if mode == self.SET:
+                removed = [product_id for product_id, quantity in quantities.items() if quantity == 0]
+                if removed:
+                    CartItem.objects.filter(cart_id=cart_id, product_id__in=removed).delete()
+            CartItem.objects.upsert_quantities(
+                cart_id, {product_id: quantity for product_id, quantity in quantities.items() if quantity},
+                increment=mode == self.ADD,
+            )
+
+        self.instance = Cart.objects.with_items().get(pk=cart_id)
         return self.instance
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(f'Product with this id {value} just not exist')
-        return value
+    def to_representation(self, instance):
+        return CartSerializer(instance).data
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -53,6 +98,8 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'total_price']
 
     def get_total_price(self, cart_item: CartItem):
+        if hasattr(cart_item, 'line_total'):
+            return cart_item.line_total
         return cart_item.product.price * cart_item.quantity
 
     # def get_product_price(self, cart_item: CartItem):
@@ -61,16 +108,29 @@ class CartItemSerializer(serializers.ModelSerializer):
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField('get_total_price')
+    tax = serializers.SerializerMethodField()
+    total_price_with_tax = serializers.SerializerMethodField()
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total_price']
+        fields = ['id', 'user', 'items', 'total_price', 'tax', 'total_price_with_tax']
         read_only_fields = ['user']
 
     def get_total_price(self, cart:Cart):
-        total_price_all = 0
-        for i in cart.items.all():
-            total_price_all += i.product.price * i.quantity
-        return total_price_all
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
+        return cart.items.total()
+
+    def pricing(self, cart):
+        # whole cart priced once, shared by the tax fields
+        if not hasattr(cart, '_pricing'):
+            cart._pricing = price_items(cart.items.all())
+        return cart._pricing
+
+    def get_tax(self, cart:Cart):
+        return self.pricing(cart)[2]
+
+    def get_total_price_with_tax(self, cart:Cart):
+        return self.pricing(cart)[3]
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
@@ -82,7 +142,7 @@ class CreateOrderSerilaizer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        if not Cart.objects.filter(pk=cart_id, user_id=self.context['user_id']).exists():
             raise serializers.ValidationError('Cart is not found')
         elif not CartItem.objects.filter(cart_id=cart_id).exists():
             raise serializers.ValidationError('This cart is empty')
@@ -105,9 +165,10 @@ class CreateOrderSerilaizer(serializers.Serializer):
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
+    payable_amount = serializers.DecimalField(max_digits=20, decimal_places=2, read_only=True)
     class Meta:
         model = Order
-        fields = ['id','user', 'status', 'total_price', 'created_at', 'items']
+        fields = ['id','user', 'status', 'total_price', 'tax_amount', 'payable_amount', 'created_at', 'items']
 
 class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
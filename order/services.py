@@ -1,26 +1,84 @@
 from order.models import Cart, CartItem, Order, OrderItem
+from product.models import Product
+from product.cache import bump_version_on_commit
+from product.pricing import category_tax_rates, money, price_lines
 from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Sum, When
 from rest_framework.exceptions import PermissionDenied, ValidationError
 
+
+def lock_products(product_ids, fields=('id',)):
+    """SELECT ... FOR UPDATE in primary key order, so concurrent checkouts can't deadlock."""
+    return Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').only(*fields)
+
+
+def change_stock(quantities, sign):
+    """One UPDATE for every product: stock = stock +/- quantity."""
+    whens = [When(pk=product_id, then=F('stock') + sign * quantity) for product_id, quantity in quantities.items()]
+    Product.objects.filter(pk__in=quantities).update(stock=Case(*whens, default=F('stock'), output_field=PositiveIntegerField()))
+    bump_version_on_commit(Product)
+
+
+def merge_guest_cart(guest_cart_id, user):
+    """
+    Fold a guest cart into the user's cart and delete it. A user without a
+    cart simply takes the guest cart over. Returns the user's cart id.
+    """
+    with transaction.atomic():
+        guest = Cart.objects.guests().select_for_update().filter(pk=guest_cart_id).first()
+        cart_id = Cart.objects.filter(user=user).values_list('pk', flat=True).first()
+        if guest is None:
+            return cart_id
+        if cart_id is None:
+            Cart.objects.filter(pk=guest.pk).update(user=user, expires_at=None)
+            return guest.pk
+
+        CartItem.objects.merge_cart(guest.pk, cart_id)
+        guest.delete()
+        return cart_id
+
+
 class OrderService:
     @staticmethod
     def create_order(cart_id, user_id):
         with transaction.atomic():
-            cart = Cart.objects.get(pk=cart_id)
-            cart_items = cart.items.select_related('product').all()
+            # locked first: a double-submitted checkout waits here and then finds the
+            # cart gone, and lines can't be added to it while the order is built
+            cart = Cart.objects.select_for_update().filter(pk=cart_id).first()
+            if cart is None:
+                raise ValueError('Cart is not found')
+            quantities = dict(cart.items.values_list('product_id', 'quantity'))
+            if not quantities:
+                raise ValueError('This cart is empty')
 
-            total_price = sum([item.product.price * item.quantity for item in cart_items])
-            order = Order.objects.create(user_id=user_id, total_price=total_price)
+            products = {product.pk: product for product in lock_products(quantities, ('id', 'name', 'price', 'stock', 'category_id'))}
+            out_of_stock = [
+                products[product_id].name
+                for product_id, quantity in sorted(quantities.items())
+                if products[product_id].stock < quantity
+            ]
+            if out_of_stock:
+                raise ValueError(f'Not enough stock for: {", ".join(out_of_stock)}')
+            change_stock(quantities, -1)
+
+            # priced from the locked products and the one read of the lines above,
+            # so the total always matches the order items
+            rates = category_tax_rates([product.category_id for product in products.values()])
+            _, total_price, tax_amount, _ = price_lines(
+                (products[product_id].price, quantity, rates[products[product_id].category_id])
+                for product_id, quantity in quantities.items()
+            )
+            order = Order.objects.create(user_id=user_id, total_price=total_price, tax_amount=tax_amount)
 
             order_items = [
                 OrderItem(
                     order = order,
-                    product = item.product,
-                    quantity = item.quantity,
-                    price = item.product.price,
-                    total_price = item.product.price * item.quantity
+                    product = products[product_id],
+                    quantity = quantity,
+                    price = products[product_id].price,
+                    total_price = money(products[product_id].price * quantity)
                 )
-                for item in cart_items
+                for product_id, quantity in quantities.items()
             ]
 
             OrderItem.objects.bulk_create(order_items)
@@ -30,19 +88,28 @@ class OrderService:
 
     @staticmethod
     def cancel_order(user, order):
-        if user.is_staff:
+        if not user.is_staff:
+            if order.user_id != user.id:
+                raise PermissionDenied({
+                    'details': 'You can only change your own order status'
+                    })
+            if order.status == Order.DELIVERED:
+                raise ValidationError({
+                    'details': 'You Cannot Cancel The Delivered Order..!!'
+                })
+
+        with transaction.atomic():
+            # re-read under lock so two cancels can't both put the stock back
+            order = Order.objects.select_for_update().get(pk=order.pk)
+            if order.status == Order.CANCELED:
+                return order
+
+            quantities = dict(
+                order.items.order_by().values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+            )
+            list(lock_products(quantities))
+            change_stock(quantities, 1)
+
             order.status = Order.CANCELED
             order.save()
-            return order
-        if order.user != user:
-            raise PermissionDenied({
-                'details': 'You can only change your own order status'
-                })
-        if order.status == Order.DELIVERED:
-            raise ValidationError({
-                'details': 'You Cannot Cancel The Delivered Order..!!'
-            })
-
-        order.status = Order.CANCELED
-        order.save()
-        return order
\ No newline at end of file
+        return order
@@ -0,0 +1,49 @@
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.utils import timezone
+from order.models import Order, PaymentCallback
+from order.payments import get_gateway, PaymentGatewayError
+
+TRAN_ID_PREFIX = 'tnx_'
+
+
+def process_payment_callback(callback_id):
+    """
+    Confirms an IPN with the gateway's validation API and moves the order from
+    NOT_PAID to READY_TO_SHIPPED with a compare-and-set UPDATE. Gateway errors
+    put the callback back to pending for `process_payment_callbacks`.
+    """
+    claimed = PaymentCallback.objects.filter(pk=callback_id, status=PaymentCallback.PENDING).update(
+        status=PaymentCallback.PROCESSING, attempts=F('attempts') + 1, updated_at=timezone.now()
+    )
+    if not claimed:
+        return  # already handled, or another worker has it
+
+    callback = PaymentCallback.objects.get(pk=callback_id)
+    try:
+        result = get_gateway().validate(callback.val_id)
+    except PaymentGatewayError as e:
+        PaymentCallback.objects.filter(pk=callback_id).update(
+            status=PaymentCallback.PENDING, error=str(e), updated_at=timezone.now()
+        )
+        return
+
+    status, error = PaymentCallback.PAID, ''
+    order_id = callback.tran_id.removeprefix(TRAN_ID_PREFIX)
+    try:
+        order = Order.objects.only('id', 'total_price', 'tax_amount').get(pk=order_id)
+        amount = Decimal(str(result.get('amount')))
+    except (Order.DoesNotExist, ValidationError, InvalidOperation):
+        order, amount = None, None
+
+    if result.get('status') not in ('VALID', 'VALIDATED') or result.get('tran_id') != callback.tran_id:
+        status, error = PaymentCallback.REJECTED, f'Gateway status {result.get("status")}'
+    elif order is None:
+        status, error = PaymentCallback.REJECTED, 'Unknown order'
+    elif amount != order.payable_amount:
+        status, error = PaymentCallback.REJECTED, f'Paid {amount}, order payable {order.payable_amount}'
+    elif not Order.objects.filter(pk=order.pk, status=Order.NOT_PAID).update(status=Order.READY_TO_SHIPPED):
+        error = 'Order was not waiting for payment'
+
+    PaymentCallback.objects.filter(pk=callback_id).update(status=status, error=error, updated_at=timezone.now())
@@ -1,3 +1,615 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import patch
+from uuid import UUID, uuid4
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.db import read_from
+from order.cart_tokens import CART_TOKEN_HEADER
+from order.models import Cart, CartItem, IdempotencyKey, Order, OrderItem, PaymentCallback
+from order.fake_gateway import FakeSSLCommerzServer
+from order.payments import AsyncSSLCommerzGateway, PaymentGatewayError, SSLCommerzGateway, get_async_gateway, get_gateway
+from order.services import OrderService
+from product.models import Category, Product
+from users.models import User
 
-# Create your tests here.
+
+class OrderTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', first_name='Buyer')
+        cls.category = Category.objects.create(name='Books', tax_rate=Decimal('0.10'))
+        cls.book = Product.objects.create(name='Novel', description='Paperback', price=10, stock=5, category=cls.category)
+        cls.pen = Product.objects.create(name='Pen', description='Blue ink', price=2, stock=20, category=cls.category)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_cart(self, user, quantities):
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=quantity) for product, quantity in quantities])
+        return cart
+
+
+class CheckoutTests(OrderTestMixin, TestCase):
+    def checkout(self, cart):
+        return self.client.post('/api/v1/orders/', {'cart_id': str(cart.pk)}, format='json')
+
+    def stock(self, product):
+        return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+    def test_checkout_decrements_stock_and_prices_every_line(self):
+        cart = self.make_cart(self.user, [(self.book, 2), (self.pen, 3)])
+        response = self.checkout(cart)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('26.00'))
+        self.assertEqual(Decimal(response.data['tax_amount']), Decimal('2.60'))
+        self.assertEqual(
+            sorted((item['product']['id'], item['quantity'], Decimal(item['total_price'])) for item in response.data['items']),
+            [(self.book.pk, 2, Decimal('20.00')), (self.pen.pk, 3, Decimal('6.00'))],
+        )
+        self.assertEqual((self.stock(self.book), self.stock(self.pen)), (3, 17))
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_oversell_is_rejected_and_nothing_changes(self):
+        cart = self.make_cart(self.user, [(self.book, 6), (self.pen, 1)])
+        response = self.checkout(cart)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Novel', str(response.data))
+        self.assertEqual((self.stock(self.book), self.stock(self.pen)), (5, 20))
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_double_submitted_checkout_is_a_400(self):
+        cart = self.make_cart(self.user, [(self.book, 2)])
+        create_order = OrderService.create_order
+
+        def first_submit_wins(cart_id, user_id):
+            # the first request commits while the second is past validation, waiting on the lock
+            create_order(cart_id=cart_id, user_id=user_id)
+            return create_order(cart_id=cart_id, user_id=user_id)
+
+        with patch.object(OrderService, 'create_order', side_effect=first_submit_wins):
+            response = self.checkout(cart)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Cart is not found', str(response.data))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stock(self.book), 3)
+
+    def test_cancel_restores_stock_once(self):
+        order_id = self.checkout(self.make_cart(self.user, [(self.book, 2), (self.pen, 3)])).data['id']
+        for _ in range(2):
+            self.assertEqual(self.client.post(f'/api/v1/orders/{order_id}/cancel/').status_code, 200)
+
+        self.assertEqual(Order.objects.get(pk=order_id).status, Order.CANCELED)
+        self.assertEqual((self.stock(self.book), self.stock(self.pen)), (5, 20))
+
+
+@contextmanager
+def without_upsert():
+    """The ON CONFLICT ... RETURNING paths off, as on backends without them."""
+    with patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+            patch.object(connection.features, 'can_return_columns_from_insert', False):
+        yield
+
+
+class CartUpsertTests(OrderTestMixin, TestCase):
+    def lines(self, cart):
+        return dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+
+    def test_repeated_adds_grow_one_line(self):
+        cart = Cart.objects.create(user=self.user)
+        url = f'/api/v1/carts/{cart.pk}/items/'
+        for quantity in (1, 2):
+            response = self.client.post(url, {'product_id': self.book.pk, 'quantity': quantity}, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 3)
+        self.assertEqual(self.lines(cart), {self.book.pk: 3})
+
+    def test_missing_product_is_a_validation_error(self):
+        cart = Cart.objects.create(user=self.user)
+        response = self.client.post(f'/api/v1/carts/{cart.pk}/items/', {'product_id': 0, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.data)
+        self.assertEqual(self.lines(cart), {})
+
+    def test_fallback_without_on_conflict_returning(self):
+        cart = Cart.objects.create(user=self.user)
+        with without_upsert():
+            first = CartItem.objects.add_quantity(cart.pk, self.book.pk, 1)
+            second = CartItem.objects.add_quantity(cart.pk, self.book.pk, 4)
+            self.assertIsNone(CartItem.objects.add_quantity(cart.pk, 0, 1))
+            CartItem.objects.upsert_quantities(cart.pk, {self.pen.pk: 2})
+            CartItem.objects.upsert_quantities(cart.pk, {self.pen.pk: 3}, increment=True)
+        self.assertEqual((first.pk, second.quantity), (second.pk, 5))
+        self.assertEqual(self.lines(cart), {self.book.pk: 5, self.pen.pk: 5})
+
+    def test_upsert_quantities_sets_or_increments(self):
+        cart = self.make_cart(self.user, [(self.book, 2)])
+        CartItem.objects.upsert_quantities(cart.pk, {self.book.pk: 1, self.pen.pk: 4}, increment=True)
+        self.assertEqual(self.lines(cart), {self.book.pk: 3, self.pen.pk: 4})
+        CartItem.objects.upsert_quantities(cart.pk, {self.book.pk: 1})
+        self.assertEqual(self.lines(cart), {self.book.pk: 1, self.pen.pk: 4})
+
+    def test_get_or_create_for_user_returns_the_same_cart(self):
+        for upsert in (True, False):
+            with self.subTest(upsert=upsert), nullcontext() if upsert else without_upsert():
+                Cart.objects.filter(user=self.user).delete()
+                cart_id, created = Cart.objects.get_or_create_for_user(self.user)
+                self.assertTrue(created)
+                self.assertEqual(Cart.objects.get_or_create_for_user(self.user), (cart_id, False))
+
+    def test_writes_ignore_a_replica_read_alias(self):
+        cart = Cart.objects.create(user=self.user)
+        other = self.make_cart(None, [(self.pen, 2)])
+        # a read routed to this alias would fail, it isn't configured
+        with read_from('replica_that_does_not_exist'):
+            CartItem.objects.add_quantity(cart.pk, self.book.pk, 1)
+            CartItem.objects.upsert_quantities(cart.pk, {self.book.pk: 2}, increment=True)
+            CartItem.objects.merge_cart(other.pk, cart.pk)
+            self.assertEqual(Cart.objects.get_or_create_for_user(self.user), (cart.pk, False))
+        self.assertEqual(self.lines(cart), {self.book.pk: 3, self.pen.pk: 2})
+
+
+class UserCartTests(OrderTestMixin, TestCase):
+    def test_mine_creates_the_cart_once_then_only_reads(self):
+        first = self.client.get('/api/v1/carts/mine/')
+        self.assertEqual(first.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/v1/carts/mine/')
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+        self.assertFalse([query['sql'] for query in queries if not query['sql'].startswith('SELECT')])
+
+
+class BulkCartItemTests(OrderTestMixin, TestCase):
+    def bulk(self, cart, mode, items):
+        return self.client.post(f'/api/v1/carts/{cart.pk}/items/bulk/', {'mode': mode, 'items': items}, format='json')
+
+    def quantities(self, response):
+        return {item['product']['id']: item['quantity'] for item in response.data['items']}
+
+    def test_add_sums_repeated_products_onto_existing_lines(self):
+        cart = self.make_cart(self.user, [(self.book, 1)])
+        response = self.bulk(cart, 'add', [
+            {'product_id': self.book.pk, 'quantity': 2},
+            {'product_id': self.pen.pk, 'quantity': 3},
+            {'product_id': self.pen.pk, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(response), {self.book.pk: 3, self.pen.pk: 4})
+
+    def test_set_replaces_quantities_and_zero_removes(self):
+        cart = self.make_cart(self.user, [(self.book, 4), (self.pen, 2)])
+        response = self.bulk(cart, 'set', [
+            {'product_id': self.book.pk, 'quantity': 1},
+            {'product_id': self.pen.pk, 'quantity': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(response), {self.book.pk: 1})
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('10.00'))
+
+    def test_unknown_product_rejects_the_whole_batch(self):
+        cart = self.make_cart(self.user, [(self.book, 1)])
+        response = self.bulk(cart, 'add', [
+            {'product_id': self.pen.pk, 'quantity': 1},
+            {'product_id': 0, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(dict(cart.items.values_list('product_id', 'quantity')), {self.book.pk: 1})
+
+    def test_other_users_cart_is_refused(self):
+        other = User.objects.create_user(email='other@example.com', first_name='Other')
+        cart = self.make_cart(other, [(self.book, 1)])
+        self.assertEqual(self.bulk(cart, 'add', [{'product_id': self.pen.pk, 'quantity': 1}]).status_code, 403)
+
+
+class GuestCartTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.guest = APIClient()
+
+    def guest_cart(self, quantities):
+        response = self.guest.post('/api/v1/carts/')
+        self.assertEqual(response.status_code, 201)
+        cart_id, token = response.data['id'], response[CART_TOKEN_HEADER]
+        for product, quantity in quantities:
+            self.guest.post(
+                f'/api/v1/carts/{cart_id}/items/', {'product_id': product.pk, 'quantity': quantity},
+                format='json', HTTP_X_CART_TOKEN=token,
+            )
+        return cart_id, token
+
+    def test_guest_cart_needs_its_token(self):
+        cart_id, token = self.guest_cart([(self.book, 2)])
+        url = f'/api/v1/carts/{cart_id}/items/'
+
+        response = self.guest.get(url, HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['product']['id'], item['quantity']) for item in response.data], [(self.book.pk, 2)])
+
+        _, other_token = self.guest_cart([])
+        for headers in ({}, {'HTTP_X_CART_TOKEN': other_token}, {'HTTP_X_CART_TOKEN': token + 'x'}):
+            with self.subTest(headers=headers):
+                self.assertEqual(self.guest.get(url, **headers).status_code, 401)
+                self.assertEqual(self.guest.get(f'/api/v1/carts/{cart_id}/', **headers).status_code, 404)
+
+    def test_merge_into_existing_user_cart(self):
+        cart = self.make_cart(self.user, [(self.book, 1)])
+        guest_cart_id, token = self.guest_cart([(self.book, 2), (self.pen, 3)])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/v1/carts/merge/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], str(cart.pk))
+        self.assertEqual(dict(cart.items.values_list('product_id', 'quantity')), {self.book.pk: 3, self.pen.pk: 3})
+        self.assertFalse(Cart.objects.filter(pk=guest_cart_id).exists())
+
+    def test_merge_hands_the_guest_cart_to_a_user_without_one(self):
+        guest_cart_id, token = self.guest_cart([(self.pen, 1)])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/v1/carts/merge/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((str(cart.pk), cart.expires_at), (guest_cart_id, None))
+
+        # the token no longer opens the cart once it belongs to someone
+        self.assertEqual(self.guest.get(f'/api/v1/carts/{guest_cart_id}/items/', HTTP_X_CART_TOKEN=token).status_code, 401)
+
+    def test_merge_without_a_valid_token(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post('/api/v1/carts/merge/').status_code, 400)
+
+    def test_purge_removes_only_expired_guest_carts(self):
+        expired = self.make_cart(None, [(self.book, 1)])
+        Cart.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        active, _ = self.guest_cart([(self.pen, 1)])
+        owned = self.make_cart(self.user, [(self.pen, 1)])
+
+        call_command('purge_guest_carts', batch_size=1, stdout=StringIO())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {UUID(active), owned.pk})
+        self.assertFalse(CartItem.objects.filter(cart_id=expired.pk).exists())
+
+
+class UnavailableHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self):
+        self.server.hits.append(self.command)
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_POST = respond
+
+
+class GatewayRetryTests(SimpleTestCase):
+    def setUp(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), UnavailableHandler)
+        server.hits = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        host, port = server.server_address[:2]
+        self.gateway = SSLCommerzGateway('store', 'pass', f'http://{host}:{port}', retries=2, backoff=0)
+
+    def test_session_create_is_not_retried_after_a_gateway_error(self):
+        with self.assertRaises(PaymentGatewayError):
+            self.gateway.create_session({'tran_id': 'tnx_1'})
+        self.assertEqual(self.server.hits, ['POST'])
+
+    def test_validation_is_retried(self):
+        with self.assertRaises(PaymentGatewayError):
+            self.gateway.validate('val_1')
+        self.assertEqual(self.server.hits, ['GET'] * 3)
+
+
+class FakeGatewayMixin(OrderTestMixin):
+    """Checkout against order.fake_gateway instead of the SSLCommerz sandbox."""
+
+    def setUp(self):
+        super().setUp()
+        config = settings.SSLCOMMERZ
+        self.gateway = FakeSSLCommerzServer(store_id=config['STORE_ID'], store_pass=config['STORE_PASS']).start()
+        self.addCleanup(self.gateway.stop)
+        self.use_gateway(self.gateway.base_url)
+
+    def use_gateway(self, base_url):
+        override = self.settings(SSLCOMMERZ={**settings.SSLCOMMERZ, 'BASE_URL': base_url, 'RETRIES': 0})
+        override.enable()
+        self.addCleanup(override.disable)
+        get_gateway.cache_clear()
+        get_async_gateway.cache_clear()
+        self.addCleanup(get_gateway.cache_clear)
+        self.addCleanup(get_async_gateway.cache_clear)
+
+    def place_order(self):
+        cart = self.make_cart(self.user, [(self.book, 2)])
+        return OrderService.create_order(cart_id=cart.pk, user_id=self.user.pk)
+
+    def initiate(self, order, amount=None):
+        return self.client.post('/api/v1/initiate/payment/', {
+            'amount': str(amount if amount is not None else order.total_price), 'orderId': str(order.pk), 'numItems': 1,
+        }, format='json')
+
+
+class InitiatePaymentTests(FakeGatewayMixin, TestCase):
+    def test_returns_the_gateway_page(self):
+        order = self.place_order()
+        response = self.initiate(order)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['payment_page_url'].startswith(self.gateway.base_url))
+        # charged lines plus tax, whatever amount the client sends
+        self.assertEqual(self.gateway.sessions[f'tnx_{order.pk}']['amount'], '22.00')
+
+    def test_unknown_or_paid_order_is_a_404(self):
+        order = self.place_order()
+        Order.objects.filter(pk=order.pk).update(status=Order.READY_TO_SHIPPED)
+        self.assertEqual(self.initiate(order).status_code, 404)
+        self.assertEqual(self.client.post('/api/v1/initiate/payment/', {'orderId': 'nope'}, format='json').status_code, 404)
+
+    def test_gateway_error_is_a_502(self):
+        self.gateway.stop()
+        self.use_gateway(self.gateway.base_url)
+        response = self.initiate(self.place_order())
+        self.assertEqual(response.status_code, 502)
+
+
+
+class AsyncGatewayTests(SimpleTestCase):
+    def setUp(self):
+        self.server = FakeSSLCommerzServer().start()
+        self.addCleanup(self.server.stop)
+        self.gateway = AsyncSSLCommerzGateway(SSLCommerzGateway(self.server.store_id, self.server.store_pass, self.server.base_url))
+
+    def test_session_and_validation_are_awaitable(self):
+        async def checkout():
+            session = await self.gateway.create_session({'tran_id': 'tnx_1', 'total_amount': '22.00'})
+            val_id = self.server.pay('tnx_1')
+            return session, await self.gateway.validate(val_id)
+
+        session, validation = asyncio.run(checkout())
+        self.assertEqual(session['status'], 'SUCCESS')
+        self.assertEqual((validation['status'], validation['tran_id']), ('VALID', 'tnx_1'))
+
+
+class InitiatePaymentAsyncTests(FakeGatewayMixin, TestCase):
+    url = '/api/v1/initiate/payment/async/'
+
+    def initiate(self, order, client=None, **headers):
+        return (client or self.client).post(self.url, {'orderId': str(order.pk)}, format='json', **headers)
+
+    def test_returns_the_gateway_page(self):
+        order = self.place_order()
+        response = self.initiate(order)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['payment_page_url'].startswith(self.gateway.base_url))
+        self.assertEqual(self.gateway.sessions[f'tnx_{order.pk}']['amount'], '22.00')
+
+    def test_errors_match_the_sync_view(self):
+        order = self.place_order()
+        self.assertEqual(self.initiate(order, client=APIClient()).status_code, 401)
+        self.assertEqual(self.client.post(self.url, {'orderId': 'nope'}, format='json').status_code, 404)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.gateway.stop()
+        self.use_gateway(self.gateway.base_url)
+        self.assertEqual(self.initiate(order).status_code, 502)
+
+    def test_idempotency_key_replays_the_session(self):
+        order = self.place_order()
+        first = self.initiate(order, HTTP_IDEMPOTENCY_KEY='pay-1')
+        second = self.initiate(order, HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.assertEqual((second.status_code, second.json()), (200, first.json()))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class PaymentIpnTests(FakeGatewayMixin, TestCase):
+    def paid_ipn(self, order, paid_amount=None):
+        """Initiate, pay on the fake gateway and return the IPN it would send."""
+        self.assertEqual(self.initiate(order).status_code, 200)
+        tran_id = f'tnx_{order.pk}'
+        if paid_amount is not None:
+            self.gateway.sessions[tran_id]['amount'] = paid_amount
+        return self.gateway.ipn_payload(self.gateway.pay(tran_id))
+
+    def send_ipn(self, payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return APIClient().post('/api/v1/payment/ipn/', payload)
+
+    def test_valid_ipn_moves_the_order_to_ready_to_ship(self):
+        order = self.place_order()
+        payload = self.paid_ipn(order)
+        self.assertEqual(Decimal(payload['amount']), order.payable_amount)
+        response = self.send_ipn(payload)
+
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.READY_TO_SHIPPED)
+        self.assertEqual(PaymentCallback.objects.get(tran_id=f'tnx_{order.pk}').status, PaymentCallback.PAID)
+
+    def test_bad_signature_is_rejected(self):
+        order = self.place_order()
+        payload = {**self.paid_ipn(order), 'verify_sign': '0' * 32}
+
+        self.assertEqual(self.send_ipn(payload).status_code, 400)
+        self.assertFalse(PaymentCallback.objects.exists())
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.NOT_PAID)
+
+    def test_duplicate_tran_id_is_dropped(self):
+        payload = self.paid_ipn(self.place_order())
+        for _ in range(3):
+            self.assertEqual(self.send_ipn(payload).status_code, 200)
+
+        callback = PaymentCallback.objects.get()
+        self.assertEqual((callback.status, callback.attempts), (PaymentCallback.PAID, 1))
+
+    def test_amount_mismatch_is_rejected(self):
+        order = self.place_order()
+        self.send_ipn(self.paid_ipn(order, paid_amount='1.00'))
+
+        callback = PaymentCallback.objects.get()
+        self.assertEqual(callback.status, PaymentCallback.REJECTED)
+        self.assertIn('Paid 1.00', callback.error)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.NOT_PAID)
+
+
+class IdempotencyTests(OrderTestMixin, TestCase):
+    def order(self, cart_id, key='checkout-1'):
+        return self.client.post('/api/v1/orders/', {'cart_id': str(cart_id)}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        cart = self.make_cart(self.user, [(self.book, 1)])
+        first = self.order(cart.pk)
+        second = self.order(cart.pk)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((second.status_code, second.json()), (201, first.json()))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_for_another_request_is_a_422(self):
+        self.order(self.make_cart(self.user, [(self.book, 1)]).pk)
+        response = self.order(uuid4())
+        self.assertEqual(response.status_code, 422)
+
+    def in_progress(self, cart_id, claimed_ago=timedelta(0)):
+        """Leave the key as a request still running (claimed `claimed_ago`) would."""
+        response = self.order(cart_id)
+        IdempotencyKey.objects.update(status_code=None, response=None, claimed_at=timezone.now() - claimed_ago)
+        return response
+
+    def test_duplicate_waits_for_the_first_response(self):
+        cart = self.make_cart(self.user, [(self.book, 1)])
+        first = self.in_progress(cart.pk)
+
+        def first_finishes(seconds):
+            IdempotencyKey.objects.update(status_code=201, response=first.json())
+
+        with patch('order.idempotency.time.sleep', side_effect=first_finishes) as sleep:
+            second = self.order(cart.pk)
+        sleep.assert_called_once()
+        self.assertEqual((second.status_code, second.json()), (201, first.json()))
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT=timedelta(0))
+    def test_duplicate_still_in_progress_after_the_wait_is_a_409(self):
+        cart = self.make_cart(self.user, [(self.book, 1)])
+        self.in_progress(cart.pk)
+        self.assertEqual(self.order(cart.pk).status_code, 409)
+
+    def test_abandoned_claim_is_taken_over(self):
+        cart = self.make_cart(self.user, [(self.book, 1)])
+        self.in_progress(cart.pk, claimed_ago=settings.IDEMPOTENCY_CLAIM_TIMEOUT)
+        Cart.objects.filter(pk=cart.pk).delete()
+        abandoned = IdempotencyKey.objects.filter(status_code__isnull=True, claimed_at=IdempotencyKey.objects.get().claimed_at)
+
+        # the retry runs the view itself (the cart is gone now, hence 400)
+        response = self.order(cart.pk)
+        self.assertEqual(response.status_code, 400)
+        # the dead worker's claim no longer matches, so it can't store or release the key
+        self.assertEqual(abandoned.update(status_code=201, response={}), 0)
+        self.assertEqual(abandoned.delete()[0], 0)
+
+    def test_failed_request_releases_the_key(self):
+        self.assertEqual(self.order(uuid4()).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_expired_key_can_be_reused(self):
+        self.order(self.make_cart(self.user, [(self.book, 1)]).pk)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        Cart.objects.filter(user=self.user).delete()
+        response = self.order(self.make_cart(self.user, [(self.pen, 1)]).pk)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class OrderExportTests(OrderTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create_user(email='admin@example.com', first_name='Admin', is_staff=True)
+        cls.old = cls.make_order(Order.DELIVERED, [(cls.book, 1)], days_ago=10)
+        cls.new = cls.make_order(Order.NOT_PAID, [(cls.book, 2), (cls.pen, 3)], days_ago=1)
+
+    @classmethod
+    def make_order(cls, status, quantities, days_ago):
+        order = Order.objects.create(user=cls.user, status=status, total_price=sum(p.price * q for p, q in quantities))
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity, price=product.price, total_price=product.price * quantity)
+            for product, quantity in quantities
+        ])
+        return order
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/orders/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_has_one_row_per_item_oldest_order_first(self):
+        rows = list(csv.DictReader(StringIO(self.export())))
+
+        self.assertEqual(
+            [(row['order_id'], row['product'], row['quantity'], row['total_price']) for row in rows],
+            [(str(self.old.pk), 'Novel', '1', '10.00'), (str(self.new.pk), 'Novel', '2', '20.00'), (str(self.new.pk), 'Pen', '3', '6.00')],
+        )
+        self.assertEqual(rows[1]['customer'], 'buyer@example.com')
+        self.assertEqual(rows[1]['status'], Order.NOT_PAID)
+
+    def test_ndjson_groups_items_under_their_order(self):
+        response = self.client.get('/api/v1/orders/export/', {'file_format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([record['order_id'] for record in records], [str(self.old.pk), str(self.new.pk)])
+        self.assertEqual(
+            [(item['product'], item['quantity']) for item in records[1]['items']],
+            [('Novel', 2), ('Pen', 3)],
+        )
+        self.assertEqual(Decimal(records[1]['order_total']), Decimal('26.00'))
+
+    def test_filters_match_the_list(self):
+        by_status = [json.loads(line)['order_id'] for line in self.export(file_format='ndjson', status=Order.DELIVERED).splitlines()]
+        self.assertEqual(by_status, [str(self.old.pk)])
+
+        since = (timezone.now() - timedelta(days=5)).isoformat()
+        by_date = [json.loads(line)['order_id'] for line in self.export(file_format='ndjson', created_at__gte=since).splitlines()]
+        self.assertEqual(by_date, [str(self.new.pk)])
+
+    def test_unknown_format_is_a_400(self):
+        response = self.client.get('/api/v1/orders/export/', {'file_format': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('csv, ndjson', str(response.data))
+
+    def test_customers_cannot_export(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/v1/orders/export/').status_code, 403)
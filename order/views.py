@@ -1,48 +1,115 @@
 from django.shortcuts import render
-from order.serializer import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer
+from order.serializer import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, BulkCartItemSerializer
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from order.models import Cart, CartItem
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from order.serializer import OrderSerializer, CreateOrderSerilaizer, UpdateOrderSerializer, CancelOrderSerializer
-from order.models import Order
+from order.models import Order, OrderItem
+from order.exports import EXPORT_FORMATS, EXPORT_LOOKUPS
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import action
-from order.services import OrderService
+from order.services import OrderService, merge_guest_cart
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view
-from sslcommerz_lib import SSLCOMMERZ
+from order.payments import get_async_gateway, get_gateway, PaymentGatewayError
+from django_filters.rest_framework import DjangoFilterBackend
+from order.filter import OrderFilter
+from product.pagination import DefaultPagination
+from order.idempotency import claim_key, idempotent, release_key, store_response
+from django.urls import reverse
+from order.models import PaymentCallback
+from order.tasks import process_payment_callback
+from api.background import run_in_background
+from api.db import ReplicaReadsMixin
+from rest_framework.permissions import AllowAny
+from rest_framework.decorators import authentication_classes, permission_classes
+from order.cart_tokens import CART_TOKEN_HEADER, make_cart_token, read_cart_token
+from order.permissions import IsCartOwner
+from django.conf import settings
+from django.utils import timezone
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.views import APIView
 
 
-class CartViewSet(GenericViewSet, CreateModelMixin, DestroyModelMixin, RetrieveModelMixin):
+class CartViewSet(ReplicaReadsMixin, GenericViewSet, CreateModelMixin, DestroyModelMixin, RetrieveModelMixin):
+    """
+    Signed-in users have one cart. Anonymous visitors get a guest cart and an
+    X-Cart-Token header to send back; `merge` folds it in after login.
+    """
     serializer_class = CartSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [AllowAny]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user=None, expires_at=timezone.now() + settings.GUEST_CART_TTL)
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Cart.objects.none()
-        return Cart.objects.prefetch_related('items__product').filter(user=self.request.user)
+        if not self.request.user.is_authenticated:
+            return Cart.objects.with_items().guests().filter(pk=read_cart_token(self.request))
+        return Cart.objects.with_items().filter(user=self.request.user)
 
     def create(self, request, *args, **kwargs):
-        existing_cart = Cart.objects.filter(user=request.user).first()
+        if not request.user.is_authenticated:
+            response = super().create(request, *args, **kwargs)
+            response[CART_TOKEN_HEADER] = make_cart_token(response.data['id'])
+            return response
 
-        if existing_cart:
-          serializer = self.get_serializer(existing_cart)
-          return Response(serializer.data, status=status.HTTP_200_OK)
+        cart, created = self.get_user_cart()
+        serializer = self.get_serializer(cart)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
-        return super.create(request, *args, **kwargs)
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def mine(self, request):
+        cart, _ = self.get_user_cart()
+        serializer = self.get_serializer(cart)
+        return Response(serializer.data)
 
+    def get_user_cart(self):
+        # plain read for the usual case; only a missing cart goes through the
+        # upsert, so concurrent first requests still can't both create one
+        cart = Cart.objects.with_items().filter(user=self.request.user).first()
+        if cart is not None:
+            return cart, False
+        cart_id, created = Cart.objects.get_or_create_for_user(self.request.user)
+        return Cart.objects.with_items().get(pk=cart_id), created
 
-class CartItemViewSet(ModelViewSet):
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def merge(self, request):
+        guest_cart_id = read_cart_token(request)
+        if guest_cart_id is None:
+            return Response({'Error': 'Invalid or expired cart token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cart_id = merge_guest_cart(guest_cart_id, request.user)
+        if cart_id is None:
+            return Response({'Error': 'Cart is not found'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = self.get_serializer(Cart.objects.with_items().get(pk=cart_id))
+        return Response(serializer.data)
+
+
+class CartItemViewSet(ReplicaReadsMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
+    permission_classes = [IsCartOwner]
+
     def get_queryset(self):
-        return CartItem.objects.select_related('product').filter(cart_id=self.kwargs.get('cart_pk'))
+        return CartItem.objects.select_related('product').with_line_total().filter(cart_id=self.kwargs.get('cart_pk'))
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, cart_pk=None):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
 
     def get_serializer_class(self):
-        if self.request.method == 'POST':
+        if self.action == 'bulk':
+            return BulkCartItemSerializer
+        elif self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
             return UpdateCartItemSerializer
@@ -55,9 +122,17 @@ class CartItemViewSet(ModelViewSet):
             return context
         return {'cart_id':self.kwargs.get('cart_pk')}
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ReplicaReadsMixin, ModelViewSet):
     # permission_classes = [permissions.IsAuthenticated]
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    pagination_class = DefaultPagination
+    export_chunk_size = 2000
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -74,17 +149,41 @@ class OrderViewSet(ModelViewSet):
         return Response({f'Order status updated to {request.data["status"]}'})
 
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream orders and their lines as ?file_format=csv (default) or ndjson,
+        filtered like the list (status, created_at__gte/lte). Rows are read in
+        chunks through a server-side cursor, so memory doesn't grow with them.
+        """
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return Response({'Error': f'file_format must be one of {", ".join(EXPORT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        stream, content_type = EXPORT_FORMATS[file_format]
+
+        orders = self.filter_queryset(Order.objects.all())
+        rows = (
+            OrderItem.objects.filter(order__in=orders.order_by().values('pk'))
+            .order_by('order__created_at', 'order_id', 'pk')
+            .values_list(*EXPORT_LOOKUPS)
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        response = StreamingHttpResponse(stream(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders-{timezone.now():%Y%m%d-%H%M%S}.{file_format}"'
+        return response
+
     def get_permissions(self):
-        if self.action in ['update_status', 'destroy']:
+        if self.action in ['update_status', 'destroy', 'export']:
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Order.objects.none()
+        queryset = Order.objects.prefetch_related('items__product').order_by('-created_at')
         if self.request.user.is_staff:
-            return Order.objects.all()
-        return Order.objects.prefetch_related('items__product').filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
 
     def get_serializer_class(self):
         if self.action == 'cancel':
@@ -105,25 +204,26 @@ class OrderViewSet(ModelViewSet):
         }
 
 
-@api_view(['POST'])
-def initiate_payment(request):
+def payable_order(request):
+    # charged what the IPN check expects, not an amount the client sends
+    try:
+        return Order.objects.only('id', 'total_price', 'tax_amount').get(
+            pk=request.data.get('orderId'), user=request.user, status=Order.NOT_PAID
+        )
+    except (Order.DoesNotExist, DjangoValidationError):
+        return None
+
+
+def payment_post_body(request, order):
     user = request.user
-    amount = request.data.get('amount')
-    order_id = request.data.get('orderId')
-    num_items = request.data.get('numItems')
-    settings = {
-        "store_id": "phima69ac8589a1fca",
-        "store_pass": "phima69ac8589a1fca@ssl",
-        "issandbox": True,
-    }
-    sslcz = SSLCOMMERZ(settings)
     post_body = {}
-    post_body['total_amount'] = amount
+    post_body['total_amount'] = order.payable_amount
     post_body['currency'] = "BDT"
-    post_body['tran_id'] = f'tnx_{order_id}'
+    post_body['tran_id'] = f'tnx_{order.pk}'
     post_body["success_url"] = "http://localhost:5173/dashboard/payment/success/"
     post_body["fail_url"] = "http://localhost:5173/dashboard/payment/fail/"
     post_body["cancel_url"] = "http://localhost:5173/dashboard/payment/cancel/"
+    post_body['ipn_url'] = request.build_absolute_uri(reverse('payment-ipn'))
     post_body['emi_option'] = 0
     post_body['cus_name'] = f'{user.first_name} {user.last_name}'
     post_body['cus_email'] = user.email
@@ -137,10 +237,122 @@ def initiate_payment(request):
     post_body['product_name'] = "Ecommerce Products"
     post_body['product_category'] = "General"
     post_body['product_profile'] = "general"
+    return post_body
+
+
+def order_not_found():
+    return Response({'Error': 'Order is not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    response = sslcz.createSession(post_body) # API response
 
+def payment_session_response(response):
     if response.get('status') == 'SUCCESS':
         return Response({"payment_page_url": response["GatewayPageURL"]})
     else:
         return Response({'Error': 'Payment Initiate Failed'})
+
+
+def payment_gateway_failed():
+    return Response({'Error': 'Payment Initiate Failed'}, status=status.HTTP_502_BAD_GATEWAY)
+
+
+@api_view(['POST'])
+@idempotent
+def initiate_payment(request):
+    order = payable_order(request)
+    if order is None:
+        return order_not_found()
+    try:
+        response = get_gateway().create_session(payment_post_body(request, order)) # API response, over the pooled client
+    except PaymentGatewayError:
+        return payment_gateway_failed()
+    return payment_session_response(response)
+
+
+def start_payment(view, request):
+    """
+    The synchronous half of initiate_payment_async, run on a worker thread:
+    authentication and permissions, the Idempotency-Key claim and the order
+    lookup. Returns (response, None, None) to answer straight away, else
+    (None, claim, post_body) for the gateway call.
+    """
+    view.initial(request)
+    response, claim = claim_key(request)
+    if response is not None:
+        return response, None, None
+    try:
+        order = payable_order(request)
+        if order is None:
+            response = order_not_found()
+            store_response(claim, response)
+            return response, None, None
+        return None, claim, payment_post_body(request, order)
+    except Exception:
+        release_key(claim)
+        raise
+
+
+@csrf_exempt
+async def initiate_payment_async(request):
+    """
+    initiate_payment for ASGI deployments (phimart/asgi.py), with the same
+    request, response and Idempotency-Key handling. The database work runs
+    on a worker thread; the gateway round trip is awaited, so no request
+    thread sits idle while SSLCommerz answers.
+    """
+    view = APIView(permission_classes=[IsAuthenticated])
+    view.setup(request)
+    view.headers = view.default_response_headers
+    drf_request = view.initialize_request(request)
+    view.request = drf_request
+    try:
+        if request.method != 'POST':
+            raise MethodNotAllowed(request.method)
+        response, claim, post_body = await sync_to_async(start_payment)(view, drf_request)
+        if response is None:
+            try:
+                response = payment_session_response(await get_async_gateway().create_session(post_body))
+            except PaymentGatewayError:
+                response = payment_gateway_failed()
+            except BaseException:
+                await sync_to_async(release_key)(claim)
+                raise
+            await sync_to_async(store_response)(claim, response)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    return view.finalize_response(drf_request, response)
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def payment_ipn(request):
+    """
+    IPN endpoint for the gateway. Only checks the signature and records the
+    callback, then acknowledges; validation and the order status change run
+    on the background workers. Repeated callbacks for a tran_id are dropped.
+    """
+    data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
+    tran_id = data.get('tran_id')
+    if not tran_id or not get_gateway().verify_signature(data):
+        return Response({'Error': 'Invalid payment notification'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if data.get('status') not in ('VALID', 'VALIDATED'):
+        PaymentCallback.objects.get_or_create(
+            tran_id=tran_id,
+            defaults={'val_id': data.get('val_id', ''), 'payload': data, 'status': PaymentCallback.REJECTED,
+                      'error': f'Gateway status {data.get("status")}'},
+        )
+        return Response({'status': 'received'})
+
+    callback, created = PaymentCallback.objects.get_or_create(
+        tran_id=tran_id, defaults={'val_id': data.get('val_id', ''), 'payload': data}
+    )
+    if not created and callback.status == PaymentCallback.REJECTED and callback.val_id != data.get('val_id'):
+        # a later, successful attempt for the same transaction
+        created = PaymentCallback.objects.filter(pk=callback.pk, status=PaymentCallback.REJECTED).update(
+            val_id=data.get('val_id', ''), payload=data, status=PaymentCallback.PENDING, error=''
+        )
+    if created:
+        run_in_background(process_payment_callback, callback.pk)
+    return Response({'status': 'received'})
+
@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Checkout clients of an ASGI deployment should use /api/v1/initiate/payment/async/
+(order.views.initiate_payment_async): it awaits the payment gateway on the event
+loop instead of holding one of the threads sync views run on.
 """
 
 import os
@@ -1,8 +1,12 @@
 
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decimal import Decimal
+from decouple import Csv, config
 import cloudinary
+import copy
+from django.core.exceptions import ImproperlyConfigured
+from corsheaders.defaults import default_headers
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -77,6 +81,8 @@ WSGI_APPLICATION = 'phimart.wsgi.app'
 CORS_ALLOWED_ORIGINS = [
   'http://localhost:5173'
 ]
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-cart-token')
+CORS_EXPOSE_HEADERS = ['X-Cart-Token']
 
 # Cloudinary Configuration
 cloudinary.config(
@@ -88,6 +94,23 @@ cloudinary.config(
 
 #media storage settings
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+CLOUDINARY_STORAGE = {
+    'CLOUD_NAME': config('cloud_name'),
+    'API_KEY': config('api_key'),
+    'API_SECRET': config('api_secret'),
+}
+
+# Product images and their resized WebP/JPEG derivatives (product/images.py).
+# PRODUCT_IMAGE_STORAGE: cloudinary | local (files under MEDIA_ROOT, no Cloudinary account needed)
+PRODUCT_IMAGE_STORAGE = config('PRODUCT_IMAGE_STORAGE', default='cloudinary')
+PRODUCT_IMAGE_STORAGE_BACKENDS = {
+    'cloudinary': 'cloudinary_storage.storage.MediaCloudinaryStorage',
+    'local': 'django.core.files.storage.FileSystemStorage',
+}
+PRODUCT_IMAGE_WIDTHS = (320, 640, 1280)
+# Direct uploads: how long an upload ticket is valid, and how many one request may ask for
+PRODUCT_IMAGE_TICKET_TTL = timedelta(minutes=15)
+PRODUCT_IMAGE_MAX_BULK = 20
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -100,6 +123,18 @@ DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 # }
 
 
+# Connections: DB_CONNECTION_MODE picks how requests get a database connection.
+#   persistent: kept open for DB_CONN_MAX_AGE seconds and health-checked before reuse
+#   pool:       Django's psycopg pool per process (needs `psycopg[pool]` instead of psycopg2)
+#   pgbouncer:  HOST/PORT point at PgBouncer in transaction mode; no server-side
+#               cursors and no startup options, which PgBouncer rejects (set the
+#               default statement_timeout on the database role instead)
+# DB_STATEMENT_TIMEOUT (ms, 0 = none) caps every query; viewsets can tighten it
+# for their list/retrieve reads with `statement_timeout` (see api/db.py).
+DB_CONNECTION_MODE = config('DB_CONNECTION_MODE', default='persistent')
+DB_STATEMENT_TIMEOUT = config('DB_STATEMENT_TIMEOUT', default=30000, cast=int)
+CATALOG_STATEMENT_TIMEOUT = config('CATALOG_STATEMENT_TIMEOUT', default=5000, cast=int)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -107,10 +142,96 @@ DATABASES = {
         'USER': config('user'),
         'PASSWORD': config('password'),
         'HOST': config('host'),
-        'PORT': config('port')
+        'PORT': config('port'),
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': config('DB_CONNECT_TIMEOUT', default=5, cast=int),
+        },
     }
 }
 
+if DB_CONNECTION_MODE == 'pool':
+    # pooled connections are handed back at the end of each request instead
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=1, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+    }
+if DB_CONNECTION_MODE == 'pgbouncer':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+elif DB_STATEMENT_TIMEOUT:
+    DATABASES['default']['OPTIONS']['options'] = f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'
+
+# Read replicas: DB_REPLICA_HOSTS lists hosts serving streaming copies of the
+# primary, with the same credentials. Viewsets with `replica_reads` send safe
+# requests to them (see api/db.py); a user who writes is pinned to the primary
+# for DB_REPLICA_PIN_SECONDS. The pin lives in DATABASE_REPLICA_PIN_CACHE, which
+# has to be shared between workers, so replicas need CATALOG_CACHE_BACKEND=file
+# (one host) or redis (see Cache below).
+DATABASE_REPLICAS = []
+for number, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {**copy.deepcopy(DATABASES['default']), 'HOST': host}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.db.ReplicaRouter']
+DATABASE_REPLICA_PIN_TTL = timedelta(seconds=config('DB_REPLICA_PIN_SECONDS', default=10, cast=int))
+DATABASE_REPLICA_PIN_CACHE = 'catalog'
+
+# Cache
+# Catalog responses are versioned (see product/cache.py): every write moves a
+# counter in this cache, so it only invalidates what readers of the same cache
+# see. CATALOG_CACHE_BACKEND:
+#   redis  - shared by every worker and host (needs the `redis` package and any
+#            Redis-protocol server at REDIS_URL); the default when REDIS_URL is set
+#   file   - shared by the workers of one host; the default otherwise
+#   dummy  - caches nothing; the default on Vercel without REDIS_URL, where each
+#            instance has its own /tmp
+#   locmem - one process only, so refused outside DEBUG
+# The replica pin (DATABASE_REPLICA_PIN_CACHE) lives in the same cache.
+
+CATALOG_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'phimart-catalog',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CATALOG_CACHE_LOCATION', default='/tmp/phimart-catalog-cache'),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_URL', default='redis://127.0.0.1:6379/1'),
+    },
+    'dummy': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+SERVERLESS = config('VERCEL', default=False, cast=bool)
+if config('REDIS_URL', default=''):
+    CATALOG_CACHE_BACKEND = config('CATALOG_CACHE_BACKEND', default='redis')
+else:
+    CATALOG_CACHE_BACKEND = config('CATALOG_CACHE_BACKEND', default='dummy' if SERVERLESS else 'file')
+if CATALOG_CACHE_BACKEND == 'locmem' and not DEBUG:
+    raise ImproperlyConfigured('CATALOG_CACHE_BACKEND=locmem is per process; use file or redis')
+if DATABASE_REPLICAS and CATALOG_CACHE_BACKEND not in (('redis',) if SERVERLESS else ('file', 'redis')):
+    raise ImproperlyConfigured('Read replicas need a shared CATALOG_CACHE_BACKEND to pin writers to the primary')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': CATALOG_CACHE_BACKENDS[CATALOG_CACHE_BACKEND],
+}
+
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Tax applied to categories without their own Category.tax_rate (product/pricing.py)
+DEFAULT_TAX_RATE = config('DEFAULT_TAX_RATE', default='0.10', cast=Decimal)
+
 INTERNAL_IPS = [
     # ...
     "127.0.0.1",
@@ -166,7 +287,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING' : False,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     # 'DEFAULT_PERMISSION_CLASSES': [
     #     'rest_framework.permissions.IsAuthenticated',
@@ -177,6 +298,44 @@ REST_FRAMEWORK = {
     # 'PAGE_SIZE':10,
 }
 
+# Payment gateway (order/payments.py). Point SSLCOMMERZ_BASE_URL at
+# `python manage.py run_fake_gateway` to test or load-test checkout offline.
+SSLCOMMERZ = {
+    'STORE_ID': config('SSLCOMMERZ_STORE_ID', default='phima69ac8589a1fca'),
+    'STORE_PASS': config('SSLCOMMERZ_STORE_PASS', default='phima69ac8589a1fca@ssl'),
+    'BASE_URL': config('SSLCOMMERZ_BASE_URL', default='https://sandbox.sslcommerz.com'),
+    'CONNECT_TIMEOUT': config('SSLCOMMERZ_CONNECT_TIMEOUT', default=3.05, cast=float),
+    'READ_TIMEOUT': config('SSLCOMMERZ_READ_TIMEOUT', default=15, cast=float),
+    'RETRIES': config('SSLCOMMERZ_RETRIES', default=2, cast=int),
+    'BACKOFF': config('SSLCOMMERZ_BACKOFF', default=0.5, cast=float),
+    'POOL_SIZE': config('SSLCOMMERZ_POOL_SIZE', default=10, cast=int),
+}
+
+# In-process worker pool for work taken off the request path (api/background.py)
+BACKGROUND_WORKERS = config('BACKGROUND_WORKERS', default=4, cast=int)
+BACKGROUND_TASKS_EAGER = config('BACKGROUND_TASKS_EAGER', default=False, cast=bool)
+# That pool can be frozen or dropped once a serverless response returns, so the
+# sweep commands re-run anything left pending. On Vercel they run as Cron Jobs
+# (vercel.json -> api.views.run_cron_job), which send `Authorization: Bearer $CRON_SECRET`.
+CRON_SECRET = config('CRON_SECRET', default='')
+
+# Responses to retried POSTs with the same Idempotency-Key are replayed for this long
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# A duplicate waits this long for the first request to finish before getting 409
+IDEMPOTENCY_WAIT = timedelta(seconds=config('IDEMPOTENCY_WAIT_SECONDS', default=10, cast=int))
+# An unfinished claim older than this belongs to a worker that died mid-request
+# (a few times the gateway's connect + read timeouts with retries) and is taken over
+IDEMPOTENCY_CLAIM_TIMEOUT = timedelta(seconds=config('IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS', default=120, cast=int))
+
+# Anonymous carts, identified by a signed X-Cart-Token, live this long (purge_guest_carts)
+GUEST_CART_TTL = timedelta(days=7)
+
+# Snapshot of the token's user kept per process (users/authentication.py); TTL in seconds
+JWT_USER_CACHE = {
+    'MAX_SIZE': config('JWT_USER_CACHE_MAX_SIZE', default=10000, cast=int),
+    'TTL': config('JWT_USER_CACHE_TTL', default=60, cast=int),
+}
+
 SIMPLE_JWT = {
    'AUTH_HEADER_TYPES': ('JWT',),
    "ACCESS_TOKEN_LIFETIME": timedelta(days=5)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ProductConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'product'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from product.search import install_search_index
+        import product.signals  # noqa: F401
+
+        post_migrate.connect(install_search_index, sender=self)
@@ -0,0 +1,124 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, quote_etag
+from api.db import read_from
+
+VERSION_KEY = 'catalog:version:{}'
+MODIFIED_KEY = 'catalog:modified:{}'
+
+
+def get_catalog_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')]
+
+
+def bump_version(model):
+    """Every cached response built from `model` stops matching once its counter moves."""
+    cache = get_catalog_cache()
+    label = model._meta.label_lower
+    # a new value rather than incr(): the file backend's incr is read-then-write,
+    # so two concurrent bumps could land on the same number
+    cache.set(VERSION_KEY.format(label), time.time_ns(), timeout=None)
+    cache.set(MODIFIED_KEY.format(label), time.time(), timeout=None)
+
+
+def bump_version_on_commit(model):
+    # readers that run before the commit must not cache old rows under the new version
+    transaction.on_commit(lambda: bump_version(model))
+
+
+def get_versions(models):
+    """Returns ({label: version}, last modified timestamp) for the given models."""
+    cache = get_catalog_cache()
+    labels = sorted(model._meta.label_lower for model in models)
+    keys = [VERSION_KEY.format(label) for label in labels] + [MODIFIED_KEY.format(label) for label in labels]
+    values = cache.get_many(keys)
+
+    versions = {}
+    now = time.time()
+    for label in labels:
+        key = VERSION_KEY.format(label)
+        if key not in values:
+            cache.add(key, time.time_ns(), timeout=None)
+            cache.add(MODIFIED_KEY.format(label), now, timeout=None)
+            values[key] = cache.get(key)
+        versions[label] = values[key]
+    last_modified = max((values.get(MODIFIED_KEY.format(label), now) for label in labels), default=now)
+    return versions, last_modified
+
+
+class CachedResponseMixin:
+    """
+    Caches rendered `list`/`retrieve` responses for anonymous JSON reads.
+
+    Keys are built from the scheme, host, path, normalized query string and the version
+    counters of `cache_dependencies`, which signals bump on every write, so a
+    stale response is never served and no TTL has to be guessed. The ETag is
+    derived from the same key, so `If-None-Match` is answered with a 304 before
+    the queryset is touched.
+    """
+    cache_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def is_cacheable(self, request):
+        return (
+            request.method in ('GET', 'HEAD')
+            and 'HTTP_AUTHORIZATION' not in request.META
+            and request.accepted_renderer.format == 'json'
+        )
+
+    def get_cache_key(self, request, versions):
+        query = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+        # bodies hold absolute URLs (pagination links, images), so scheme and host are part of the key
+        origin = (request.scheme, request.get_host())
+        raw = repr((origin, request.path, query, request.accepted_media_type, sorted(versions.items())))
+        return 'catalog:response:' + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        versions, last_modified = get_versions(self.cache_dependencies)
+        if None in versions.values():
+            # the cache keeps nothing (DummyCache), so neither responses nor ETags can be versioned
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request, versions)
+        etag = quote_etag(key.rsplit(':', 1)[-1])
+        headers = {'ETag': etag, 'Last-Modified': http_date(last_modified)}
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return HttpResponseNotModified(headers=headers)
+
+        cache = get_catalog_cache()
+        entry = cache.get(key)
+        if entry is not None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        else:
+            # a replica may not have replayed the write that moved the version yet,
+            # and whatever is built now stays cached until the next write
+            if time.time() - last_modified < settings.DATABASE_REPLICA_PIN_TTL.total_seconds():
+                with read_from(DEFAULT_DB_ALIAS):
+                    response = handler(request, *args, **kwargs)
+            else:
+                response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60 * 24)
+            response.add_post_render_callback(
+                lambda rendered: cache.set(key, {
+                    'content': rendered.content,
+                    'content_type': rendered['Content-Type'],
+                }, timeout)
+            )
+
+        for header, value in headers.items():
+            response[header] = value
+        return response
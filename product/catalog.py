@@ -0,0 +1,86 @@
+import csv
+import json
+import sys
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from product.models import Category, Product, ProductImage
+
+FORMATS = ('csv', 'jsonl')
+
+# column -> queryset lookup used when exporting
+EXPORT_COLUMNS = {
+    'category': {'id': 'id', 'name': 'name', 'description': 'description'},
+    'product': {
+        'id': 'id', 'name': 'name', 'description': 'description', 'price': 'price', 'stock': 'stock',
+        'category': 'category__name',
+    },
+    'image': {'id': 'id', 'product_id': 'product_id', 'image': 'image_path'},
+}
+MODELS = {'category': Category, 'product': Product, 'image': ProductImage}
+
+
+def export_queryset(model_name):
+    queryset = MODELS[model_name].objects.order_by('pk')
+    if model_name == 'image':
+        # the stored Cloudinary path, without going through CloudinaryResource
+        queryset = queryset.annotate(image_path=Cast('image', output_field=CharField()))
+    return queryset.values_list(*EXPORT_COLUMNS[model_name].values())
+
+
+def guess_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def open_file(path, mode):
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def read_rows(file, fmt):
+    """Yield one dict per row without reading the whole file."""
+    if fmt == 'csv':
+        for row in csv.DictReader(file):
+            yield row
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_rows(file, fmt, columns, rows):
+    """Write value tuples from an iterator, returns the number written."""
+    written = 0
+    if fmt == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n')
+            written += 1
+    return written
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def optional_id(value):
+    return int(value) if value not in (None, '') else None
+
+
+def to_decimal(value):
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'Invalid price {value!r}')
@@ -1,10 +1,38 @@
 from django_filters.rest_framework import FilterSet
-from product.models import Product
+from rest_framework.filters import SearchFilter
+from product.models import Product, Review
+from product.search import get_search_backend, search_tokens
 
 class ProductFilter(FilterSet):
     class Meta:
         model = Product
         fields = {
             'category_id' : ['exact'],
-            'price' : ['gt', 'lt']
-        }
\ No newline at end of file
+            'price' : ['gt', 'lt'],
+            'rating_avg' : ['gte', 'lte'],
+            'rating_count' : ['gte'],
+        }
+
+
+class ReviewFilter(FilterSet):
+    class Meta:
+        model = Review
+        fields = {
+            'ratings' : ['exact'],
+        }
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    Same `?search=` parameter as SearchFilter, answered by the database's
+    full-text index and ranked by relevance. `?ordering=` still wins over
+    the rank. Falls back to SearchFilter's icontains lookups when there is
+    no backend for the database.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        tokens = search_tokens(self.get_search_terms(request))
+        backend = get_search_backend(queryset.db)
+        if not tokens or backend is None:
+            return super().filter_queryset(request, queryset, view)
+        return backend.search(queryset, tokens).order_by('-search_rank', 'id')
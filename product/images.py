@@ -0,0 +1,89 @@
+from functools import lru_cache
+from io import BytesIO
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# format name -> (Pillow format, extension, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+@lru_cache(maxsize=None)
+def get_image_storage():
+    return import_string(settings.PRODUCT_IMAGE_STORAGE_BACKENDS[settings.PRODUCT_IMAGE_STORAGE])()
+
+
+def product_image_storage():
+    # referenced by ProductImage.file (and its migrations), so a plain function
+    return get_image_storage()
+
+
+def uses_local_storage():
+    return settings.PRODUCT_IMAGE_STORAGE == 'local'
+
+
+def load_image(data):
+    """
+    Decode and check an upload, raising ValidationError for anything Pillow
+    can't read or that decodes to more pixels than Image.MAX_IMAGE_PIXELS allows.
+    """
+    try:
+        with Image.open(BytesIO(data)) as probe:
+            probe.verify()
+        image = Image.open(BytesIO(data))
+        return ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ValidationError(f'Upload a valid image. {e}')
+
+
+def target_widths(width):
+    """Configured widths smaller than the original, or the original width for small images."""
+    widths = [target for target in settings.PRODUCT_IMAGE_WIDTHS if target < width]
+    return widths or [width]
+
+
+def make_derivatives(data, prefix):
+    """
+    Resize an image to every target width in each format and store the
+    files under `prefix`. Returns (width, height, derivatives), the
+    derivatives as [{'format', 'width', 'height', 'name'}].
+    """
+    storage = get_image_storage()
+    image = load_image(data)
+    width, height = image.size
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    derivatives = []
+    for target in target_widths(width):
+        size = (target, max(1, round(height * target / width)))
+        resized = image if size == image.size else image.resize(size, Image.Resampling.LANCZOS)
+        for name, (pil_format, extension, options) in DERIVATIVE_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            stored = storage.save(f'{prefix}/{target}w.{extension}', ContentFile(buffer.getvalue()))
+            derivatives.append({'format': name, 'width': size[0], 'height': size[1], 'name': stored})
+    return width, height, derivatives
+
+
+def delete_derivatives(derivatives):
+    storage = get_image_storage()
+    for derivative in derivatives:
+        storage.delete(derivative['name'])
+
+
+def srcsets(derivatives, absolute_url=None):
+    """{'webp': 'url 320w, url 640w', 'jpeg': ...}; URLs are built here, not stored."""
+    storage = get_image_storage()
+    sets = {}
+    for derivative in derivatives:
+        url = storage.url(derivative['name'])
+        if absolute_url is not None:
+            url = absolute_url(url)
+        sets.setdefault(derivative['format'], []).append(f'{url} {derivative["width"]}w')
+    return {name: ', '.join(candidates) for name, candidates in sets.items()}
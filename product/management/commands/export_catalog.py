@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from product.catalog import EXPORT_COLUMNS, FORMATS, export_queryset, guess_format, open_file, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream categories, products or product images to CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(EXPORT_COLUMNS))
+        parser.add_argument('path', nargs='?', default='-', help='Output file, - for stdout')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension, else csv')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        columns = EXPORT_COLUMNS[options['model']]
+        fmt = guess_format(options['path'], options['format'])
+        rows = export_queryset(options['model']).iterator(chunk_size=options['chunk_size'])
+
+        started = time.monotonic()
+        output = open_file(options['path'], 'w')
+        try:
+            written = write_rows(output, fmt, list(columns), rows)
+        finally:
+            if options['path'] != '-':
+                output.close()
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stderr.write(self.style.SUCCESS(f'Exported {written} {options["model"]} rows in {elapsed:.1f}s ({written / elapsed:.0f} rows/s)'))
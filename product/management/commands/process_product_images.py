@@ -0,0 +1,21 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from product.models import ProductImage
+from product.tasks import process_product_image
+
+
+class Command(BaseCommand):
+    help = 'Process uploaded product images still pending (restarted or frozen workers)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stuck-after', type=int, default=10, help='Minutes before a pending image is retried')
+
+    def handle(self, *args, **options):
+        stuck = timezone.now() - timedelta(minutes=options['stuck_after'])
+        pending = ProductImage.objects.filter(status=ProductImage.PENDING, created_at__lt=stuck).values_list('pk', flat=True)
+        processed = 0
+        for image_id in pending.iterator():
+            process_product_image(image_id)
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} product images'))
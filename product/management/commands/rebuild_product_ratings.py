@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from product.models import Product, Review, RATING_STARS, rating_average
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating statistics of every product from its reviews in one UPDATE'
+
+    def handle(self, *args, **options):
+        reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+        def aggregate(expression):
+            return Coalesce(Subquery(reviews.annotate(value=expression).values('value')), 0)
+
+        count = aggregate(Count('pk'))
+        total = aggregate(Sum('ratings'))
+        updates = {
+            'rating_count': count,
+            'rating_sum': total,
+            'rating_avg': rating_average(total, count),
+        }
+        for star in RATING_STARS:
+            updates[f'rating_{star}'] = aggregate(Count('pk', filter=Q(ratings=star)))
+
+        with transaction.atomic():
+            updated = Product.objects.update(**updates)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating statistics for {updated} products'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from product.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recompute Category.product_count from the product table and report any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted categories')
+
+    def handle(self, *args, **options):
+        drifted = list(
+            Category.objects.annotate(actual=Count('products'))
+            .exclude(product_count=F('actual'))
+            .values_list('pk', 'name', 'product_count', 'actual')
+        )
+        for pk, name, stored, actual in drifted:
+            self.stdout.write(f'{name} (#{pk}): stored {stored}, actual {actual}')
+
+        if drifted and not options['dry_run']:
+            with transaction.atomic():
+                Category.objects.filter(pk__in=[row[0] for row in drifted]).recount_products()
+
+        self.stdout.write(self.style.SUCCESS(f'{len(drifted)} categories drifted'))
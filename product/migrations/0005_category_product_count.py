@@ -0,0 +1,30 @@
+# Generated by Django 5.2.10 on 2026-10-18 12:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_product_count(apps, schema_editor):
+    Category = apps.get_model('product', 'Category')
+    Product = apps.get_model('product', 'Product')
+    counts = Product.objects.filter(category=OuterRef('pk')).order_by().values('category').annotate(
+        total=Count('pk')
+    ).values('total')
+    Category.objects.update(product_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_product_count, migrations.RunPython.noop),
+    ]
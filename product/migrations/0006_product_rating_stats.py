@@ -0,0 +1,76 @@
+# Generated by Django 5.2.10 on 2026-10-18 12:29
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Review = apps.get_model('product', 'Review')
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+    def aggregate(expression):
+        return Coalesce(Subquery(reviews.annotate(value=expression).values('value')), 0)
+
+    count = aggregate(Count('pk'))
+    total = aggregate(Sum('ratings'))
+    updates = {
+        'rating_count': count,
+        'rating_sum': total,
+        'rating_avg': Coalesce(Cast(total, FloatField()) / NullIf(count, 0), Value(0.0)),
+    }
+    for star in range(1, 6):
+        updates[f'rating_{star}'] = aggregate(Count('pk', filter=Q(ratings=star)))
+    Product.objects.update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_category_product_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
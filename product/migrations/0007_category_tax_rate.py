@@ -0,0 +1,19 @@
+# Generated by Django 5.2.10 on 2026-10-18 12:45
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_product_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='tax_rate',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=5, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.10 on 2026-10-18 12:47
+
+import cloudinary.models
+import product.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0007_category_tax_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='file',
+            field=models.ImageField(blank=True, storage=product.images.product_image_storage, upload_to='products/images/'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='height',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, verbose_name='image'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.10 on 2026-10-18 16:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_product_image_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.10 on 2026-10-18 16:24
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0010_productimage_created_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='product',
+            options={'base_manager_name': 'objects', 'ordering': ['id']},
+        ),
+    ]
@@ -1,16 +1,129 @@
-from django.db import models
+from collections import Counter
+from contextvars import ContextVar
+from django.db import models, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from product.validators import validate_file_size
 from cloudinary.models import CloudinaryField
+from django.contrib.postgres.search import SearchVectorField
+from product.cache import bump_version_on_commit
+from product.images import delete_derivatives, make_derivatives, product_image_storage
+
+# set while ProductQuerySet.delete() adjusts the counters itself
+_bulk_product_delete = ContextVar('bulk_product_delete', default=False)
+
+RATING_STARS = range(1, 6)
+
+def rating_average(total, count):
+    return Coalesce(Cast(total, FloatField()) / NullIf(count, 0), Value(0.0))
+
+class CategoryQuerySet(models.QuerySet):
+    def adjust_product_count(self, changes):
+        """Apply {category_id: delta}, one UPDATE per distinct delta."""
+        by_delta = {}
+        for category_id, delta in changes.items():
+            if delta and category_id is not None:
+                by_delta.setdefault(delta, []).append(category_id)
+        for delta, category_ids in by_delta.items():
+            count = F('product_count') + delta if delta > 0 else Greatest(F('product_count') + delta, Value(0))
+            self.filter(pk__in=sorted(category_ids)).update(product_count=count)
+        if by_delta:
+            bump_version_on_commit(Category)
+
+    def recount_products(self):
+        counts = Product.objects.filter(category=OuterRef('pk')).order_by().values('category').annotate(
+            total=Count('pk')
+        ).values('total')
+        bump_version_on_commit(Category)
+        return self.update(product_count=Coalesce(Subquery(counts), 0))
 
 class Category(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    # e.g. 0.0750 for 7.5%; empty uses settings.DEFAULT_TAX_RATE
+    tax_rate = models.DecimalField(
+        max_digits=5, decimal_places=4, null=True, blank=True,
+        validators=[MinValueValidator(0), MaxValueValidator(1)],
+    )
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    """Keeps Category.product_count right for the bulk paths that skip save()/signals."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            if kwargs.get('update_conflicts') or kwargs.get('ignore_conflicts'):
+                # inserted vs. updated rows aren't reported, so recount what may have moved
+                existing = [obj.pk for obj in objs if obj.pk is not None]
+                affected = {obj.category_id for obj in objs}
+                affected.update(self.filter(pk__in=existing).values_list('category_id', flat=True))
+                created = super().bulk_create(objs, *args, **kwargs)
+                Category.objects.filter(pk__in=affected).recount_products()
+            else:
+                created = super().bulk_create(objs, *args, **kwargs)
+                Category.objects.adjust_product_count(Counter(obj.category_id for obj in created))
+        bump_version_on_commit(Product)
+        return created
+
+    def update(self, **kwargs):
+        if 'category' not in kwargs and 'category_id' not in kwargs:
+            return super().update(**kwargs)
+        category = kwargs.get('category_id', kwargs.get('category'))
+        category_id = category.pk if isinstance(category, Category) else category
+        with transaction.atomic(using=self.db, savepoint=False):
+            before = dict(self.order_by().values_list('category_id').annotate(total=Count('pk')))
+            rows = super().update(**kwargs)
+            if hasattr(category_id, 'resolve_expression'):
+                Category.objects.recount_products()
+            else:
+                changes = Counter({old_id: -total for old_id, total in before.items()})
+                changes[category_id] += rows
+                Category.objects.adjust_product_count(changes)
+        bump_version_on_commit(Product)
+        return rows
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            before = dict(self.order_by().values_list('category_id').annotate(total=Count('pk')))
+            token = _bulk_product_delete.set(True)
+            try:
+                deleted = super().delete()
+            finally:
+                _bulk_product_delete.reset(token)
+            Category.objects.adjust_product_count({category_id: -total for category_id, total in before.items()})
+        return deleted
+
+    def adjust_ratings(self, product_id, added=(), removed=()):
+        """Fold added/removed review ratings into the stored stats with one UPDATE."""
+        count_delta = len(added) - len(removed)
+        sum_delta = sum(added) - sum(removed)
+        histogram = Counter(added)
+        histogram.subtract(removed)
+
+        # the right-hand side of an UPDATE sees the old row, so avg uses the new totals
+        updates = {
+            'rating_count': F('rating_count') + count_delta,
+            'rating_sum': F('rating_sum') + sum_delta,
+            'rating_avg': rating_average(F('rating_sum') + sum_delta, F('rating_count') + count_delta),
+        }
+        for star, delta in histogram.items():
+            if delta and star in RATING_STARS:
+                updates[f'rating_{star}'] = F(f'rating_{star}') + delta
+        return self.filter(pk=product_id).update(**updates)
+
+class ProductManager(models.Manager.from_queryset(ProductQuerySet)):
+    def get_queryset(self):
+        # search_vector is written by a database trigger, Django never reads or saves it
+        return super().get_queryset().defer('search_vector')
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField()
@@ -19,18 +132,78 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # review statistics, maintained incrementally by Review.save() and review deletes
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
 
+    objects = ProductManager()
 
     class Meta:
         ordering = ['id',]
+        # related lookups (review.product, prefetching items__product) defer search_vector too
+        base_manager_name = 'objects'
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        previous_category_id = getattr(self, '_loaded_category_id', None)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if adding:
+                Category.objects.adjust_product_count({self.category_id: 1})
+            elif previous_category_id is not None and previous_category_id != self.category_id:
+                Category.objects.adjust_product_count({previous_category_id: -1, self.category_id: 1})
+        self._loaded_category_id = self.category_id
+
 class ProductImage(models.Model):
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = CloudinaryField('image')
+    image = CloudinaryField('image', blank=True)
     # file = models.FileField(upload_to='products/files', validators=[])
+    file = models.ImageField(upload_to='products/images/', storage=product_image_storage, blank=True)  # local storage mode
+    width = models.PositiveIntegerField(null=True, editable=False)
+    height = models.PositiveIntegerField(null=True, editable=False)
+    derivatives = models.JSONField(default=list, blank=True, editable=False)
+    # derivatives are built by a background worker after upload (product/tasks.py)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def url(self):
+        if self.file:
+            return self.file.url
+        return self.image.url if self.image else None
+
+    def build_derivatives(self, data):
+        """Resize the original (`data`, its bytes) and record the stored derivatives."""
+        previous = self.derivatives
+        self.width, self.height, self.derivatives = make_derivatives(data, f'products/derivatives/{self.pk}')
+        self.status = self.READY
+        self.save(update_fields=['width', 'height', 'derivatives', 'status'])
+        if previous:
+            delete_derivatives(previous)
 
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete = models.CASCADE)
@@ -41,4 +214,24 @@ class Review(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f'Review By {self.user.first_name}'
\ No newline at end of file
+        return f'Review By {self.user.first_name}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('ratings'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        previous_product_id, previous_ratings = getattr(self, '_loaded_rating', (None, None))
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if previous_product_id is None:
+                Product.objects.adjust_ratings(self.product_id, added=[self.ratings])
+            elif (previous_product_id, previous_ratings) != (self.product_id, self.ratings):
+                if previous_product_id == self.product_id:
+                    Product.objects.adjust_ratings(self.product_id, added=[self.ratings], removed=[previous_ratings])
+                else:
+                    Product.objects.adjust_ratings(previous_product_id, removed=[previous_ratings])
+                    Product.objects.adjust_ratings(self.product_id, added=[self.ratings])
+        self._loaded_rating = (self.product_id, self.ratings)
\ No newline at end of file
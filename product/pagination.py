@@ -1,4 +1,171 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor (keyset) pagination over every ordering field plus an `id` tie breaker.
+
+    The cursor stores the ordering values of the last row that was sent, so the
+    next page is fetched with a `WHERE (price, id) > (...)` style filter instead
+    of `OFFSET`, and there is no `COUNT(*)`. A page costs the same at any depth.
+    """
+    page_size = 10
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('id',)
+    tiebreak_field = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+        ordering = self.reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, cursor['position']))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        """Ordering requested through `OrderingFilter`, always ending on the tie breaker."""
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = list(ordering or self.get_default_ordering(queryset))
+        if self.tiebreak_field not in [field.lstrip('-') for field in ordering]:
+            ordering.append(self.tiebreak_field)
+        return ordering
+
+    def get_default_ordering(self, queryset):
+        return self.ordering
+
+    def reverse_ordering(self, ordering):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+    def keyset_filter(self, ordering, position):
+        """(a > x) OR (a = x AND b > y) OR ... for a mixed ascending/descending ordering."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_position(self, obj):
+        return [self.to_cursor_value(obj, field.lstrip('-')) for field in self.ordering]
+
+    def to_cursor_value(self, obj, name):
+        try:
+            return self.model._meta.get_field(name).value_to_string(obj)
+        except FieldDoesNotExist:
+            return getattr(obj, name)  # a numeric annotation, e.g. search_rank
+
+    def from_cursor_value(self, name, value):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f'{name} must be a number')
+            return value
+        return field.to_python(value)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            raw_position = data['p']
+            if len(raw_position) != len(self.ordering):
+                raise ValueError('cursor does not match ordering')
+            position = [
+                self.from_cursor_value(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, raw_position)
+            ]
+            return {'position': position, 'reverse': bool(data.get('r'))}
+        except (TypeError, ValueError, KeyError, ValidationError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        data = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ProductCursorPagination(KeysetPagination):
+    """
+    Opt-in with `?pagination=cursor`; the `next`/`previous` links keep the mode.
+    Without `?ordering=`, `?search=` results stay in relevance order: the rank
+    is part of the cursor like any other ordering value.
+    """
+    page_size = 10
+    rank_field = 'search_rank'
+
+    def get_default_ordering(self, queryset):
+        if self.rank_field in queryset.query.annotations:
+            return (f'-{self.rank_field}',)
+        return super().get_default_ordering(queryset)
+
+
+class ReviewCursorPagination(KeysetPagination):
+    """Newest reviews first."""
+    page_size = 10
+    ordering = ('-created_at',)
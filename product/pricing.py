@@ -0,0 +1,61 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db.models import DecimalField, F, Value
+from django.db.models.functions import Coalesce, Round
+from product.models import Category
+
+CENT = Decimal('0.01')
+RATE_FIELD = DecimalField(max_digits=5, decimal_places=4)
+PRICE_FIELD = DecimalField(max_digits=20, decimal_places=2)
+
+
+def money(value):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def apply_tax(amount, rate):
+    return money(amount * (1 + rate))
+
+
+def tax_rate(category_path='category'):
+    """The effective rate of a row's category, as an expression."""
+    return Coalesce(F(f'{category_path}__tax_rate'), Value(settings.DEFAULT_TAX_RATE), output_field=RATE_FIELD)
+
+
+def with_price_with_tax(queryset, category_path='category', price='price'):
+    """Annotate `tax_rate` and `price_with_tax`, computed by the database."""
+    return queryset.annotate(tax_rate=tax_rate(category_path)).annotate(
+        price_with_tax=Round(F(price) * (Value(1, output_field=RATE_FIELD) + F('tax_rate')), 2, output_field=PRICE_FIELD)
+    )
+
+
+def category_tax_rates(category_ids):
+    """{category_id: effective rate} in one query."""
+    rates = dict(Category.objects.filter(pk__in=set(category_ids), tax_rate__isnull=False).values_list('pk', 'tax_rate'))
+    return {category_id: rates.get(category_id, settings.DEFAULT_TAX_RATE) for category_id in category_ids}
+
+
+def price_lines(lines):
+    """
+    Price a cart or order in one pass. `lines` yields (unit price, quantity,
+    tax rate); returns (line totals with tax, subtotal, tax, total), each
+    line rounded once so the lines always add up to the total.
+    """
+    line_totals, subtotal, total = [], Decimal('0.00'), Decimal('0.00')
+    for price, quantity, rate in lines:
+        net = money(price * quantity)
+        gross = apply_tax(net, rate)
+        line_totals.append(gross)
+        subtotal += net
+        total += gross
+    return line_totals, subtotal, total - subtotal, total
+
+
+def price_items(items):
+    """price_lines() for cart/order items with `.product` and `.quantity`, tax_rate annotated or not."""
+    items = list(items)
+    rates = {item.product.category_id: item.tax_rate for item in items if getattr(item, 'tax_rate', None) is not None}
+    missing = [item.product.category_id for item in items if item.product.category_id not in rates]
+    if missing:
+        rates.update(category_tax_rates(missing))
+    return price_lines((item.product.price, item.quantity, rates[item.product.category_id]) for item in items)
@@ -0,0 +1,126 @@
+import re
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def search_tokens(terms):
+    """Plain words only, so no user input ever reaches tsquery/FTS5 syntax."""
+    return [token.lower() for term in terms for token in TOKEN_PATTERN.findall(term)]
+
+
+class PostgresFullTextSearch:
+    """
+    `search_vector` is a tsvector column kept up to date by a trigger
+    (name weighted above description) and indexed with GIN.
+    """
+    config = 'english'
+
+    def search(self, queryset, tokens):
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), config=self.config, search_type='raw')
+        # ts_rank() is real; as double precision it round-trips exactly through a cursor
+        rank = Cast(SearchRank(F('search_vector'), query), FloatField())
+        return queryset.filter(search_vector=query).annotate(search_rank=rank)
+
+    def install(self, connection, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector :=
+                        setweight(to_tsvector('{self.config}', coalesce(NEW.name, '')), 'A') ||
+                        setweight(to_tsvector('{self.config}', coalesce(NEW.description, '')), 'B');
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_search_vector_trigger ON {table}')
+            cursor.execute(f"""
+                CREATE TRIGGER {table}_search_vector_trigger
+                BEFORE INSERT OR UPDATE OF name, description ON {table}
+                FOR EACH ROW EXECUTE FUNCTION {table}_search_vector_update()
+            """)
+            cursor.execute(f'UPDATE {table} SET name = name WHERE search_vector IS NULL')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_search_vector_gin ON {table} USING gin (search_vector)')
+
+
+class SQLiteFullTextSearch:
+    """Local/test fallback: an external-content FTS5 shadow table maintained by triggers."""
+
+    def search(self, queryset, tokens):
+        table = queryset.model._meta.db_table
+        fts = f'{table}_fts'
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', (match,))
+        ).annotate(
+            # bm25() is lower for better matches
+            search_rank=RawSQL(
+                f'SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {table}.id', (match,)
+            )
+        )
+
+    def install(self, connection, table):
+        fts = f'{table}_fts'
+        with connection.cursor() as cursor:
+            # Django's SQLite schema editor rebuilds tables on most ALTERs, which drops
+            # the triggers, so they are re-created (and the index rebuilt) when missing.
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", (f'{fts}_%',)
+            )
+            if cursor.fetchone()[0] == 3:
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"name, description, content='{table}', content_rowid='id')"
+            )
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts}(rowid, name, description) VALUES (new.id, new.name, new.description);
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF name, description ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+                    INSERT INTO {fts}(rowid, name, description) VALUES (new.id, new.name, new.description);
+                END
+            """)
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresFullTextSearch,
+    'sqlite': SQLiteFullTextSearch,
+}
+
+
+def get_search_backend(using='default'):
+    """`PRODUCT_SEARCH_BACKEND` (dotted path) wins, otherwise pick by database vendor."""
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    backend = SEARCH_BACKENDS.get(connections[using].vendor)
+    return backend() if backend else None
+
+
+def install_search_index(sender, using='default', **kwargs):
+    """post_migrate hook: create the triggers/index the active backend relies on."""
+    from product.models import Product
+
+    connection = connections[using]
+    table = Product._meta.db_table
+    backend = get_search_backend(using)
+    if backend is None or table not in connection.introspection.table_names():
+        return
+    backend.install(connection, table)
@@ -1,8 +1,17 @@
+import cloudinary.exceptions
 from rest_framework import serializers
 from decimal import Decimal
-from product.models import Category, Product, Review, ProductImage
+from product.pricing import apply_tax, category_tax_rates, with_price_with_tax
+from product.images import srcsets, uses_local_storage
+from product.uploads import missing_uploads, read_ticket
+from product.tasks import process_product_image, process_product_images
+from api.background import run_in_background
+from django.conf import settings
+from product.validators import validate_file_size
+from product.models import Category, Product, Review, ProductImage, RATING_STARS
 from users.models import User
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
 
 # class CategorySerializer(serializers.Serializer):
 #     id = serializers.IntegerField()
@@ -32,31 +41,185 @@ from django.contrib.auth import get_user_model
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'product_count']
+        fields = ['id', 'name', 'description', 'product_count', 'tax_rate']
 
     product_count = serializers.IntegerField(read_only=True, help_text='Count of all products in specific category')  # "help_text" is for swagger
 
 class ProductImageSerializer(serializers.ModelSerializer):
-    image = serializers.ImageField()
+    image = serializers.ImageField(write_only=True, validators=[validate_file_size])
+    srcset = serializers.SerializerMethodField(help_text='Resized WebP and JPEG versions, per format, as srcset strings')
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'status', 'width', 'height', 'srcset']
 
+    def get_srcset(self, product_image):
+        request = self.context.get('request')
+        return srcsets(product_image.derivatives, request.build_absolute_uri if request is not None else None)
 
-class ProductSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        url = instance.url
+        request = self.context.get('request')
+        if url and request is not None:
+            url = request.build_absolute_uri(url)
+        return {'id': data.pop('id'), 'image': url, **data}
+
+    def create(self, validated_data):
+        upload = validated_data.pop('image')
+        data = upload.read()
+        upload.seek(0)
+        validated_data['file' if uses_local_storage() else 'image'] = upload
+        validated_data['status'] = ProductImage.PENDING
+        product_image = super().create(validated_data)
+        run_in_background(process_product_image, product_image.pk, data)
+        return product_image
+
+
+class UploadTicketRequestSerializer(serializers.Serializer):
+    count = serializers.IntegerField(min_value=1, max_value=settings.PRODUCT_IMAGE_MAX_BULK, default=1)
+
+
+class FinalizeUploadSerializer(serializers.Serializer):
+    tickets = serializers.ListField(
+        child=serializers.CharField(), allow_empty=False, max_length=settings.PRODUCT_IMAGE_MAX_BULK
+    )
+
+    def validate_tickets(self, tickets):
+        product_id = self.context['product_id']
+        keys = [read_ticket(ticket, product_id) for ticket in tickets]
+        if None in keys:
+            raise serializers.ValidationError('Upload ticket is invalid or expired')
+        try:
+            missing = missing_uploads(keys)
+        except cloudinary.exceptions.Error:
+            raise serializers.ValidationError('Could not check the uploads, try again')
+        if missing:
+            raise serializers.ValidationError(f'Nothing was uploaded for {len(missing)} ticket(s)')
+        return list(dict.fromkeys(keys))
+
+    def save(self, **kwargs):
+        """One row per uploaded original, then validation and resizing in the background."""
+        product_id = self.context['product_id']
+        keys = self.validated_data['tickets']
+        column = 'file' if uses_local_storage() else 'image'
+        # finalizing the same ticket twice doesn't add the image twice
+        done = set(ProductImage.objects.filter(product_id=product_id, **{f'{column}__in': keys}).values_list(column, flat=True))
+        images = ProductImage.objects.bulk_create([
+            ProductImage(product_id=product_id, status=ProductImage.PENDING, **{column: key})
+            for key in keys if key not in done
+        ])
+        if column == 'image':
+            # CloudinaryField only parses a stored key when loading a row
+            field = ProductImage._meta.get_field('image')
+            for image in images:
+                image.image = field.to_python(image.image)
+        run_in_background(process_product_images, [image.pk for image in images])
+        self.instance = images
+        return images
+
+
+def split_param(request, name):
+    value = request.query_params.get(name, '') if request is not None else ''
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    ?fields=a,b picks the top-level fields of a read, ?expand=x,y adds
+    expandable relations (nested instead of a primary key). Subclasses
+    declare which columns and prefetches each field needs, so views can
+    load only those (see `optimize_queryset`).
+    """
+    expandable_fields = {}  # name -> callable building the nested serializer
+    field_columns = {}      # name -> model columns it reads, default [name]
+    field_prefetches = {}   # name -> prefetch_related lookup
+    field_annotations = {}  # name -> function annotating the queryset
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected, expand = self.sparse_fields(self.context.get('request'))
+        for name in expand:
+            self.fields[name] = self.expandable_fields[name]()
+        if selected is not None:
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
+    @classmethod
+    def sparse_fields(cls, request):
+        """(selected field names or None for all, expanded relations) for a read request."""
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return None, set()
+        expand = {name for name in split_param(request, 'expand') if name in cls.expandable_fields}
+        fields = split_param(request, 'fields')
+        if not fields:
+            return None, expand
+        known = set(cls.Meta.fields) | set(cls.expandable_fields)
+        return {name for name in fields if name in known} | expand | {'id'}, expand
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request, extra_columns=()):
+        selected, expand = cls.sparse_fields(request)
+        names = selected if selected is not None else set(cls.Meta.fields) | expand
+        for name in sorted(names):
+            if name in cls.field_annotations:
+                queryset = cls.field_annotations[name](queryset)
+        prefetches = [cls.field_prefetches[name] for name in names if name in cls.field_prefetches]
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        related = sorted(name for name in expand if name not in cls.field_prefetches)
+        if related:
+            queryset = queryset.select_related(*related)
+        if selected is None:
+            return queryset
+
+        columns = {'id', *extra_columns}
+        for name in names:
+            columns.update(cls.field_columns.get(name, [name]))
+        for name in related:
+            nested = cls.expandable_fields[name]()
+            columns.update(f'{name}__{field}' for field in nested.Meta.fields)
+        return queryset.only(*sorted(columns))
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
+    expandable_fields = {
+        'category': lambda: CategorySerializer(read_only=True),
+        'images': lambda: ProductImageSerializer(many=True, read_only=True),
+    }
+    field_columns = {
+        'price_with_tax': ['price'],
+        'rating_histogram': [f'rating_{star}' for star in RATING_STARS],
+        'images': [],
+    }
+    field_prefetches = {'images': Prefetch('images', queryset=ProductImage.objects.filter(status=ProductImage.READY))}
+    field_annotations = {'price_with_tax': with_price_with_tax}
     class Meta:
         model = Product
-        fields = ['id','name', 'description', 'price', 'stock', 'category','price_with_tax', 'images']
+        fields = ['id','name', 'description', 'price', 'stock', 'category','price_with_tax', 'images',
+                  'rating_avg', 'rating_count', 'rating_histogram']
 
     price_with_tax = serializers.SerializerMethodField('calculate_tax')
+    rating_histogram = serializers.SerializerMethodField(help_text='Number of reviews per star, 1 to 5')
     # category = serializers.HyperlinkedRelatedField(
     #     queryset = Category.objects.all(),
     #     view_name = 'view_specific_category'
     # )
 
     def calculate_tax(self, product):
-        return round(product.price * Decimal(1.1), 2)
+        if hasattr(product, 'price_with_tax'):
+            return product.price_with_tax  # computed by the list/detail query
+        rate = category_tax_rates([product.category_id])[product.category_id]
+        return apply_tax(product.price, rate)
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # annotated when the row was loaded, before the new price or category applied
+        instance.__dict__.pop('price_with_tax', None)
+        return instance
+
+    def get_rating_histogram(self, product):
+        return {str(star): getattr(product, f'rating_{star}') for star in RATING_STARS}
 
     def validate_price(self, price):
         if price < 0:
@@ -83,15 +246,12 @@ class SimpleUserSerializer(serializers.ModelSerializer):
 
 class ReviewSerializer(serializers.ModelSerializer):
     # first_name = User.objects.get
-    user = serializers.SerializerMethodField(method_name='get_user')
+    user = SimpleUserSerializer(read_only=True)  # one nested serializer for the whole page, user comes from select_related
     class Meta:
         model = Review
-        fields=['id', 'user', 'product', 'comment', 'ratings']
+        fields=['id', 'user', 'product', 'comment', 'ratings', 'created_at']
         read_only_fields = ['user', 'product']
 
-    def get_user(self, obj):
-        return SimpleUserSerializer(obj.user).data
-
     def create(self, validated_data):
         product_id = self.context['product_id']
         return Review.objects.create(product_id=product_id, **validated_data)
@@ -0,0 +1,60 @@
+import logging
+import cloudinary.exceptions
+import cloudinary.uploader
+from django.db.models.signals import post_save, post_delete
+from product.models import Category, Product, ProductImage, Review, _bulk_product_delete
+from product.cache import bump_version_on_commit
+from product.images import delete_derivatives
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def bump_catalog_version(sender, **kwargs):
+    bump_version_on_commit(sender)
+
+
+def decrement_product_count(sender, instance, **kwargs):
+    # instance and cascade deletes; QuerySet.delete() does its own grouped update
+    if not _bulk_product_delete.get():
+        Category.objects.adjust_product_count({instance.category_id: -1})
+
+
+for model in (Category, Product, ProductImage):
+    post_save.connect(bump_catalog_version, sender=model, dispatch_uid=f'catalog-version-save-{model.__name__}')
+    post_delete.connect(bump_catalog_version, sender=model, dispatch_uid=f'catalog-version-delete-{model.__name__}')
+
+post_delete.connect(decrement_product_count, sender=Product, dispatch_uid='category-product-count-delete')
+
+
+def delete_image_files(sender, instance, **kwargs):
+    # after commit, so a rolled back delete keeps its files
+    derivatives, original = instance.derivatives, instance.file
+    public_id = getattr(instance.image, 'public_id', instance.image)  # the Cloudinary original, if any
+    def delete():
+        delete_derivatives(derivatives)
+        if original:
+            original.delete(save=False)
+        if public_id:
+            try:
+                cloudinary.uploader.destroy(public_id, invalidate=True)
+            except cloudinary.exceptions.Error as e:
+                logger.warning('Could not delete Cloudinary image %s: %s', public_id, e)
+    transaction.on_commit(delete)
+
+
+post_delete.connect(delete_image_files, sender=ProductImage, dispatch_uid='product-image-files-delete')
+
+
+def bump_product_version(sender, **kwargs):
+    # reviews are rendered into the product's rating fields
+    bump_version_on_commit(Product)
+
+
+def remove_review_rating(sender, instance, **kwargs):
+    Product.objects.adjust_ratings(instance.product_id, removed=[instance.ratings])
+
+
+post_save.connect(bump_product_version, sender=Review, dispatch_uid='catalog-version-save-Review')
+post_delete.connect(bump_product_version, sender=Review, dispatch_uid='catalog-version-delete-Review')
+post_delete.connect(remove_review_rating, sender=Review, dispatch_uid='product-rating-delete')
@@ -0,0 +1,37 @@
+import logging
+import requests
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from product.models import ProductImage
+from product.validators import validate_file_size
+
+logger = logging.getLogger(__name__)
+
+
+def read_original(product_image):
+    if product_image.file:
+        with product_image.file.open('rb') as original:
+            return original.read()
+    response = requests.get(product_image.image.build_url(), timeout=(3.05, 30))
+    response.raise_for_status()
+    return response.content
+
+
+def process_product_image(image_id, data=None):
+    """Validate an uploaded original and build its derivatives; runs on the background pool."""
+    product_image = ProductImage.objects.filter(pk=image_id, status=ProductImage.PENDING).first()
+    if product_image is None:
+        return
+    try:
+        if data is None:
+            data = read_original(product_image)
+        validate_file_size(ContentFile(data))
+        product_image.build_derivatives(data)
+    except (ValidationError, OSError, requests.RequestException) as e:
+        logger.warning('Product image %s rejected: %s', image_id, e)
+        ProductImage.objects.filter(pk=image_id).update(status=ProductImage.FAILED)
+
+
+def process_product_images(image_ids):
+    for image_id in image_ids:
+        process_product_image(image_id)
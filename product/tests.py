@@ -1,3 +1,640 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest.mock import patch
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.utils import ConnectionHandler
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from product.cache import get_catalog_cache
+from product.images import get_image_storage
+from product.models import Category, Product, ProductImage, Review
+from product.pagination import ProductCursorPagination
+from product.search import PostgresFullTextSearch
+from product.tasks import process_product_image
+from product.uploads import make_ticket
+from users.models import User
 
-# Create your tests here.
+
+class ReviewListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(
+            name='Runner', description='Running shoe', price=50, stock=10, category=category
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = f'/api/v1/products/{self.product.pk}/reviews/'
+
+    def add_reviews(self, count, ratings=5):
+        start = User.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create_user(email=f'user{i}@example.com', first_name=f'User{i}')
+            Review.objects.create(product=self.product, user=user, comment='Nice', ratings=ratings)
+
+    def test_query_count_does_not_grow_with_reviews(self):
+        self.add_reviews(2)
+        with self.assertNumQueries(1):
+            small = self.client.get(self.url)
+        self.add_reviews(20)
+        with self.assertNumQueries(1):
+            large = self.client.get(self.url)
+
+        self.assertEqual(len(small.data['results']), 2)
+        self.assertEqual(len(large.data['results']), 10)
+        self.assertEqual(set(large.data['results'][0]['user']), {'id', 'name'})
+
+    def test_cursor_pages_cover_every_review_newest_first(self):
+        self.add_reviews(25)
+        ids, url = [], self.url
+        while url:
+            response = self.client.get(url)
+            ids += [review['id'] for review in response.data['results']]
+            url = response.data['next']
+
+        expected = list(Review.objects.order_by('-created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_filter_by_ratings(self):
+        self.add_reviews(3, ratings=5)
+        self.add_reviews(2, ratings=1)
+        response = self.client.get(self.url, {'ratings': 1})
+        self.assertEqual([review['ratings'] for review in response.data['results']], [1, 1])
+
+
+
+
+class RatingStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        cls.runner = Product.objects.create(name='Runner', price=50, stock=5, category=category)
+        cls.boot = Product.objects.create(name='Boot', price=80, stock=5, category=category)
+        cls.users = [User.objects.create_user(email=f'reviewer{i}@example.com') for i in range(3)]
+
+    def review(self, product, user, ratings):
+        return Review.objects.create(product=product, user=user, comment='Fine', ratings=ratings)
+
+    def stats(self, product):
+        product = Product.objects.get(pk=product.pk)
+        histogram = [getattr(product, f'rating_{star}') for star in range(1, 6)]
+        return product.rating_count, product.rating_sum, product.rating_avg, histogram
+
+    def test_create_updates_the_stats(self):
+        self.review(self.runner, self.users[0], 5)
+        self.review(self.runner, self.users[1], 2)
+        self.assertEqual(self.stats(self.runner), (2, 7, 3.5, [0, 1, 0, 0, 1]))
+
+    def test_rating_change_and_product_move(self):
+        review = self.review(self.runner, self.users[0], 5)
+        self.review(self.runner, self.users[1], 3)
+
+        review.ratings = 1
+        review.save()
+        self.assertEqual(self.stats(self.runner), (2, 4, 2.0, [1, 0, 1, 0, 0]))
+
+        review.product = self.boot
+        review.save()
+        self.assertEqual(self.stats(self.runner), (1, 3, 3.0, [0, 0, 1, 0, 0]))
+        self.assertEqual(self.stats(self.boot), (1, 1, 1.0, [1, 0, 0, 0, 0]))
+
+        review.comment = 'Edited'
+        review.save()
+        self.assertEqual(self.stats(self.boot), (1, 1, 1.0, [1, 0, 0, 0, 0]))
+
+    def test_instance_and_queryset_deletes(self):
+        first = self.review(self.runner, self.users[0], 4)
+        self.review(self.runner, self.users[1], 2)
+        self.review(self.runner, self.users[2], 2)
+
+        first.delete()
+        self.assertEqual(self.stats(self.runner), (2, 4, 2.0, [0, 2, 0, 0, 0]))
+        Review.objects.filter(product=self.runner).delete()
+        self.assertEqual(self.stats(self.runner), (0, 0, 0.0, [0, 0, 0, 0, 0]))
+
+    def test_filter_and_order_by_rating(self):
+        get_catalog_cache().clear()
+        self.review(self.runner, self.users[0], 2)
+        self.review(self.boot, self.users[0], 5)
+        self.review(self.boot, self.users[1], 4)
+
+        client = APIClient()
+        response = client.get('/api/v1/products/', {'rating_avg__gte': 4})
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.boot.pk])
+        response = client.get('/api/v1/products/', {'ordering': '-rating_avg'})
+        results = response.json()['results']
+        self.assertEqual([item['id'] for item in results], [self.boot.pk, self.runner.pk])
+        self.assertEqual((results[0]['rating_avg'], results[0]['rating_count']), (4.5, 2))
+        self.assertEqual(results[0]['rating_histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1})
+
+    def test_rebuild_recomputes_drifted_stats(self):
+        self.review(self.runner, self.users[0], 5)
+        self.review(self.runner, self.users[1], 4)
+        Product.objects.update(rating_count=9, rating_sum=1, rating_avg=0, rating_5=0, rating_1=7)
+
+        out = StringIO()
+        call_command('rebuild_product_ratings', stdout=out)
+        self.assertIn('Rebuilt rating statistics for 2 products', out.getvalue())
+        self.assertEqual(self.stats(self.runner), (2, 9, 4.5, [0, 0, 0, 1, 1]))
+        self.assertEqual(self.stats(self.boot), (0, 0, 0.0, [0, 0, 0, 0, 0]))
+
+
+@patch.object(ProductCursorPagination, 'page_size', 3)
+class ProductCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        # weakest match first, so relevance order isn't id order
+        names = [
+            ('Sandal', 'Light and open, a summer shoe for the beach and the pool and the garden'),
+            ('Boot', 'Leather shoe'),
+            ('Shoe', 'Shoe'),
+            ('Cap', 'Cotton'),
+            ('Sock', 'Wool'),
+            ('Belt', 'Leather'),
+            ('Scarf', 'Silk'),
+        ]
+        prices = [5, 5, 3, 8, 5, 3, 1]
+        cls.products = [
+            Product.objects.create(name=name, description=description, price=price, stock=1, category=category)
+            for (name, description), price in zip(names, prices)
+        ]
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+
+    def walk(self, url, link='next'):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            pages.append([item['id'] for item in response.json()['results']])
+            url = response.json()[link]
+        return pages
+
+    def cursor(self, position, reverse=False):
+        data = json.dumps({'p': position, 'r': int(reverse)})
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def test_mixed_direction_ordering_walks_every_row_once(self):
+        pages = self.walk('/api/v1/products/?pagination=cursor&ordering=-price')
+        expected = [p.pk for p in sorted(self.products, key=lambda p: (-p.price, p.pk))]
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+
+    def test_previous_links_walk_back_over_the_same_pages(self):
+        url = '/api/v1/products/?pagination=cursor&ordering=-price'
+        pages = self.walk(url)
+        last = self.client.get(url).json()
+        while last['next']:
+            last = self.client.get(last['next']).json()
+        backwards = self.walk(last['previous'], link='previous')
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_cursor_starts_after_its_position(self):
+        sandal, boot = self.products[:2]
+        cursor = self.cursor(['5.00', boot.pk])
+        response = self.client.get(f'/api/v1/products/?ordering=-price&cursor={cursor}')
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.products[4].pk, self.products[2].pk, self.products[5].pk])
+
+        cursor = self.cursor(['5.00', boot.pk], reverse=True)
+        response = self.client.get(f'/api/v1/products/?ordering=-price&cursor={cursor}')
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.products[3].pk, sandal.pk])
+
+    def test_tampered_cursor_is_not_found(self):
+        for cursor in ['not-a-cursor', self.cursor([5]), self.cursor(['cheap', 1]), self.cursor(['5.00', 'x'])]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/v1/products/?ordering=-price&cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+    def test_postgres_rank_round_trips_through_the_cursor(self):
+        # ts_rank() is real: compared as such to the cursor's double, the cursor row would repeat
+        postgres = ConnectionHandler({DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'phimart'}})
+        queryset = PostgresFullTextSearch().search(Product.objects.all(), ['shoe']).filter(search_rank__lt=0.25)
+        sql, _ = queryset.query.get_compiler(connection=postgres[DEFAULT_DB_ALIAS]).as_sql()
+        self.assertEqual(sql.count('::double precision'), 2)
+
+    def test_search_keeps_relevance_order(self):
+        ranked = self.client.get('/api/v1/products/?search=shoe').json()['results']
+        ranked = [item['id'] for item in ranked]
+        self.assertEqual(len(ranked), 3)
+        self.assertNotEqual(ranked, sorted(ranked))
+        pages = self.walk('/api/v1/products/?pagination=cursor&search=shoe')
+        self.assertEqual([pk for page in pages for pk in page], ranked)
+
+
+
+
+class SparseFieldsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shoes', tax_rate=Decimal('0.10'))
+        cls.products = [
+            Product.objects.create(name=f'Runner {i}', description='Shoe', price=price, stock=5, category=cls.category)
+            for i, price in enumerate([30, 10, 20])
+        ]
+        ProductImage.objects.create(product=cls.products[0], image='products/sample.jpg')
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+
+    def get(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], [query['sql'] for query in queries]
+
+    def test_fields_trims_the_output_and_the_select(self):
+        results, queries = self.get(fields='name,price_with_tax')
+        self.assertEqual(set(results[0]), {'id', 'name', 'price_with_tax'})
+        self.assertEqual(results[0]['price_with_tax'], 33.0)
+        product_query = next(sql for sql in queries if 'FROM "product_product"' in sql and 'COUNT' not in sql)
+        self.assertNotIn('"description"', product_query)
+        self.assertFalse([sql for sql in queries if 'product_productimage' in sql])
+
+    def test_expand_nests_category_and_images(self):
+        results, queries = self.get(expand='category,images')
+        first = results[0]
+        self.assertEqual(first['category'], {
+            'id': self.category.pk, 'name': 'Shoes', 'description': None, 'product_count': 3, 'tax_rate': 0.1,
+        })
+        self.assertEqual([image['id'] for image in first['images']], [self.products[0].images.get().pk])
+        self.assertEqual(sum('product_productimage' in sql for sql in queries), 1)
+
+    def test_unknown_names_are_ignored(self):
+        results, _ = self.get(fields='name,secret', expand='owner')
+        self.assertEqual(set(results[0]), {'id', 'name'})
+        results, _ = self.get(expand='owner')
+        self.assertEqual(results[0]['category'], self.category.pk)
+
+    def test_cursor_mode_keeps_the_ordering_columns(self):
+        results, queries = self.get(fields='name', ordering='-price', pagination='cursor')
+        self.assertEqual([item['name'] for item in results], ['Runner 0', 'Runner 2', 'Runner 1'])
+        # the cursor is built from price without reloading each deferred row
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"price"', queries[0])
+
+
+class ProductManagerTests(TestCase):
+    def test_related_lookups_defer_search_vector(self):
+        category = Category.objects.create(name='Shoes')
+        product = Product.objects.create(name='Runner', price=50, stock=5, category=category)
+        user = User.objects.create_user(email='reviewer@example.com', password='pass')
+        Review.objects.create(product=product, user=user, comment='Good', ratings=4)
+        with CaptureQueriesContext(connection) as queries:
+            Review.objects.get().product.name
+            list(Review.objects.prefetch_related('product'))
+        self.assertEqual(len(queries), 4)
+        self.assertFalse([query['sql'] for query in queries if 'search_vector' in query['sql']])
+
+
+class ProductTaxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Books', tax_rate='0.10')
+        cls.product = Product.objects.create(
+            name='Novel', description='Paperback', price=10, stock=5, category=cls.category
+        )
+        cls.staff = User.objects.create_user(email='staff@example.com', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = f'/api/v1/products/{self.product.pk}/'
+
+    def test_update_returns_price_with_tax_for_the_new_price(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.patch(self.url, {'price': '100.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['price_with_tax'], Decimal('110.00'))
+
+    def test_category_tax_change_invalidates_cached_products(self):
+        get_catalog_cache().clear()
+        self.assertEqual(self.client.get(self.url).json()['price_with_tax'], 11)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.tax_rate = Decimal('0.50')
+            self.category.save()
+        self.assertEqual(self.client.get(self.url).json()['price_with_tax'], 15)
+
+
+class CategoryCountTests(TestCase):
+    def test_bulk_category_move_invalidates_cached_counts(self):
+        source = Category.objects.create(name='Source')
+        target = Category.objects.create(name='Target')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Lamp', description='Desk lamp', price=20, stock=3, category=source)
+        get_catalog_cache().clear()
+        client = APIClient()
+
+        counts = {row['id']: row['product_count'] for row in client.get('/api/v1/categories/').json()}
+        self.assertEqual((counts[source.pk], counts[target.pk]), (1, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(category=source).update(category=target)
+        counts = {row['id']: row['product_count'] for row in client.get('/api/v1/categories/').json()}
+        self.assertEqual((counts[source.pk], counts[target.pk]), (0, 1))
+
+
+
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(name='Runner', price=50, stock=5, category=cls.category)
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+        self.url = f'/api/v1/products/{self.product.pk}/'
+
+    def test_responses_are_cached_per_scheme_and_host(self):
+        Product.objects.bulk_create([
+            Product(name=f'Runner {i}', price=50, stock=5, category=self.category) for i in range(10)
+        ])
+        local = self.client.get('/api/v1/products/', HTTP_HOST='127.0.0.1')
+        deployed = self.client.get('/api/v1/products/', HTTP_HOST='shop.vercel.app', secure=True)
+        self.assertTrue(local.json()['next'].startswith('http://127.0.0.1/'))
+        self.assertTrue(deployed.json()['next'].startswith('https://shop.vercel.app/'))
+        self.assertNotEqual(local['ETag'], deployed['ETag'])
+
+    @override_settings(CACHES={**settings.CACHES, 'catalog': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_a_cache_that_keeps_nothing_is_bypassed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(price=60)
+        self.assertEqual(self.client.get(self.url).json()['price'], 60)
+
+    def test_hit_is_served_without_queries(self):
+        miss = self.client.get(self.url, {'expand': 'category'})
+        with self.assertNumQueries(0):
+            hit = self.client.get(self.url, {'expand': 'category'})
+        self.assertEqual(hit.content, miss.content)
+        self.assertEqual((hit['ETag'], hit['Last-Modified']), (miss['ETag'], miss['Last-Modified']))
+        self.assertLessEqual(parse_http_date(hit['Last-Modified']), time.time())
+
+    def test_not_modified_answers_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_to_each_dependency_invalidate(self):
+        product = Product.objects.get(pk=self.product.pk)
+        category = Category.objects.get(pk=self.category.pk)
+        image = ProductImage(product=product)
+
+        def save_product():
+            product.price = 60
+            product.save()
+
+        def save_category():
+            category.name = 'Sneakers'
+            category.save()
+
+        writes = [
+            ('product save', save_product),
+            ('category save', save_category),
+            ('image save', image.save),
+            ('image delete', lambda: ProductImage.objects.get(pk=image.pk).delete()),
+        ]
+        for label, write in writes:
+            with self.subTest(label):
+                before = self.client.get(self.url, {'expand': 'category'})
+                with self.captureOnCommitCallbacks(execute=True):
+                    write()
+                after = self.client.get(self.url, {'expand': 'category'})
+                self.assertNotEqual(after['ETag'], before['ETag'])
+                self.assertNotEqual(after.content, before.content)
+
+        detail = self.client.get(self.url, {'expand': 'category'}).json()
+        self.assertEqual((detail['price'], detail['category']['name'], detail['images']), (60, 'Sneakers', []))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        category_url = f'/api/v1/categories/{self.category.pk}/'
+        self.assertEqual(self.client.get(category_url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            category.delete()
+        self.assertEqual(self.client.get(category_url).status_code, 404)
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        self.assertEqual(self.client.get(self.url).json()['price'], 50)
+        # the version never moves: the commit callbacks don't run in a TestCase
+        Product.objects.filter(pk=self.product.pk).update(price=60)
+        self.assertEqual(self.client.get(self.url).json()['price'], 50)
+
+        user = User.objects.create_user(email='buyer@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['price'], 60)
+        self.assertNotIn('ETag', response)
+
+
+
+class CatalogImportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Shoes')
+        cls.runner = Product.objects.create(name='Runner', description='Road', price=50, stock=5, category=cls.shoes)
+        cls.boot = Product.objects.create(name='Boot', description='Hiking', price=80, stock=2, category=cls.shoes)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def export(self, name):
+        path = self.directory / name
+        call_command('export_catalog', 'product', str(path), stderr=StringIO())
+        return path
+
+    def load(self, path):
+        call_command('import_catalog', 'product', str(path), stdout=StringIO())
+
+    def assert_imported(self):
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(Product.objects.get(pk=self.runner.pk).price, Decimal('45.00'))
+        self.assertEqual(Product.objects.get(pk=self.boot.pk).category.name, 'Boots')
+        hat = Product.objects.get(name='Hat')
+        self.assertEqual((hat.category_id, hat.stock), (self.shoes.pk, 7))
+        counts = dict(Category.objects.values_list('name', 'product_count'))
+        self.assertEqual(counts, {'Shoes': 2, 'Boots': 1})
+
+    def test_csv_round_trip(self):
+        path = self.export('products.csv')
+        with open(path, newline='') as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual([row['name'] for row in rows], ['Runner', 'Boot'])
+        self.assertEqual(rows[0]['category'], 'Shoes')
+
+        rows[0]['price'] = '45.00'
+        rows[1]['category'] = 'Boots'
+        rows.append({'id': '', 'name': 'Hat', 'description': '', 'price': '15', 'stock': '7', 'category': 'Shoes'})
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        self.load(path)
+        self.assert_imported()
+
+    def test_jsonl_round_trip(self):
+        path = self.export('products.jsonl')
+        rows = [json.loads(line) for line in path.read_text().splitlines()]
+        self.assertEqual(rows[1], {
+            'id': self.boot.pk, 'name': 'Boot', 'description': 'Hiking', 'price': '80.00', 'stock': 2, 'category': 'Shoes',
+        })
+
+        rows[0]['price'] = '45.00'
+        rows[1]['category'] = 'Boots'
+        rows.append({'name': 'Hat', 'price': 15, 'stock': 7, 'category': 'Shoes'})
+        path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+        self.load(path)
+        self.assert_imported()
+
+    def test_bad_row_is_a_command_error(self):
+        path = self.directory / 'products.jsonl'
+        path.write_text(json.dumps({'name': 'Hat', 'price': 'cheap', 'stock': 1, 'category': 'Shoes'}) + '\n')
+        with self.assertRaisesMessage(CommandError, "Row 1-1: ValueError(\"Invalid price 'cheap'\")"):
+            self.load(path)
+        self.assertFalse(Product.objects.filter(name='Hat').exists())
+
+
+@override_settings(PRODUCT_IMAGE_STORAGE='cloudinary')
+class ProductImageUploadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(name='Runner', price=50, stock=5, category=category)
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = f'/api/v1/products/{self.product.pk}/images/finalize/'
+
+    def test_finalize_refuses_tickets_nothing_was_uploaded_for(self):
+        ticket, key = make_ticket(self.product.pk)
+        with patch('cloudinary.api.resources_by_ids', return_value={'resources': []}) as lookup:
+            response = self.client.post(self.url, {'tickets': [ticket]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        lookup.assert_called_once_with([key])
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_finalize_registers_uploaded_originals(self):
+        ticket, key = make_ticket(self.product.pk)
+        with patch('cloudinary.api.resources_by_ids', return_value={'resources': [{'public_id': key}]}):
+            response = self.client.post(self.url, {'tickets': [ticket]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ProductImage.objects.get().status, ProductImage.PENDING)
+
+    def test_deleting_an_image_removes_the_cloudinary_original(self):
+        image = ProductImage.objects.create(product=self.product, image='products/uploads/1/original')
+        with patch('cloudinary.uploader.destroy') as destroy:
+            with self.captureOnCommitCallbacks(execute=True):
+                ProductImage.objects.get(pk=image.pk).delete()
+        destroy.assert_called_once_with('products/uploads/1/original', invalidate=True)
+
+    def test_sweep_processes_only_stale_pending_images(self):
+        stale, fresh, ready = ProductImage.objects.bulk_create([
+            ProductImage(product=self.product, image='products/uploads/stale', status=ProductImage.PENDING),
+            ProductImage(product=self.product, image='products/uploads/fresh', status=ProductImage.PENDING),
+            ProductImage(product=self.product, image='products/uploads/ready', status=ProductImage.READY),
+        ])
+        ProductImage.objects.exclude(pk=fresh.pk).update(created_at=timezone.now() - timedelta(minutes=30))
+        out = StringIO()
+        with patch('product.management.commands.process_product_images.process_product_image') as process:
+            call_command('process_product_images', stuck_after=10, stdout=out)
+        process.assert_called_once_with(stale.pk)
+        self.assertIn('Processed 1 product images', out.getvalue())
+
+
+def png(width, height):
+    buffer = BytesIO()
+    Image.new('RGBA', (width, height), (200, 10, 10, 128)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@override_settings(PRODUCT_IMAGE_STORAGE='local', BACKGROUND_TASKS_EAGER=True)
+class LocalProductImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(name='Runner', price=50, stock=5, category=category)
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', is_staff=True)
+
+    def setUp(self):
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        get_image_storage.cache_clear()
+        self.addCleanup(get_image_storage.cache_clear)
+        self.storage = get_image_storage()
+        # ImageField resolves its storage callable once, at import
+        self.enterContext(patch.object(ProductImage._meta.get_field('file'), 'storage', self.storage))
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = f'/api/v1/products/{self.product.pk}/images/'
+
+    def upload_via_ticket(self, data):
+        ticket = self.client.post(f'{self.url}tickets/', {}, format='json').data['tickets'][0]['ticket']
+        upload = SimpleUploadedFile('original.png', data)
+        self.assertEqual(self.client.post(f'{self.url}upload/', {'ticket': ticket, 'file': upload}).status_code, 204)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'{self.url}finalize/', {'tickets': [ticket]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        return ProductImage.objects.get(pk=response.data[0]['id'])
+
+    def test_upload_stores_resized_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'image': SimpleUploadedFile('big.png', png(1000, 500))}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        image = ProductImage.objects.get(pk=response.data['id'])
+        self.assertEqual((image.status, image.width, image.height), (ProductImage.READY, 1000, 500))
+        self.assertEqual(
+            [(d['format'], d['width'], d['height']) for d in image.derivatives],
+            [('webp', 320, 160), ('jpeg', 320, 160), ('webp', 640, 320), ('jpeg', 640, 320)],
+        )
+        for derivative in image.derivatives:
+            with Image.open(self.storage.path(derivative['name'])) as stored:
+                self.assertEqual(stored.size, (derivative['width'], derivative['height']))
+
+        srcset = self.client.get(f'{self.url}{image.pk}/').data['srcset']
+        prefix = f'http://testserver/media/products/derivatives/{image.pk}'
+        self.assertEqual(srcset['webp'], f'{prefix}/320w.webp 320w, {prefix}/640w.webp 640w')
+        self.assertEqual(srcset['jpeg'], f'{prefix}/320w.jpg 320w, {prefix}/640w.jpg 640w')
+
+    def test_small_image_keeps_its_own_width(self):
+        image = self.upload_via_ticket(png(200, 100))
+        self.assertEqual(image.status, ProductImage.READY)
+        self.assertEqual({(d['width'], d['height']) for d in image.derivatives}, {(200, 100)})
+
+    def test_non_image_upload_fails(self):
+        with self.assertLogs('product.tasks', 'WARNING'):
+            image = self.upload_via_ticket(b'not an image')
+        self.assertEqual((image.status, image.derivatives), (ProductImage.FAILED, []))
+
+    def test_decompression_bomb_fails(self):
+        image = ProductImage.objects.create(product=self.product, status=ProductImage.PENDING)
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 100), self.assertLogs('product.tasks', 'WARNING'):
+            process_product_image(image.pk, png(100, 100))
+        image.refresh_from_db()
+        self.assertEqual((image.status, image.derivatives), (ProductImage.FAILED, []))
@@ -0,0 +1,54 @@
+import time
+from uuid import uuid4
+import cloudinary
+import cloudinary.api
+import cloudinary.utils
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from product.images import get_image_storage, uses_local_storage
+
+UPLOAD_TICKET_SALT = 'product.image-upload'
+
+
+def make_ticket(product_id):
+    """A signed, short-lived permission to upload one original for a product."""
+    key = f'products/uploads/{product_id}/{uuid4().hex}'
+    return signing.dumps({'product': int(product_id), 'key': key}, salt=UPLOAD_TICKET_SALT, compress=True), key
+
+
+def read_ticket(ticket, product_id):
+    """The storage key a valid, unexpired ticket for this product grants, else None."""
+    try:
+        data = signing.loads(ticket, salt=UPLOAD_TICKET_SALT, max_age=settings.PRODUCT_IMAGE_TICKET_TTL)
+    except signing.BadSignature:
+        return None
+    if str(data['product']) != str(product_id):
+        return None
+    return data['key']
+
+
+def missing_uploads(keys):
+    """The keys nothing was uploaded to yet, checked in one Admin API call on Cloudinary."""
+    if uses_local_storage():
+        storage = get_image_storage()
+        return [key for key in keys if not storage.exists(key)]
+    found = {resource['public_id'] for resource in cloudinary.api.resources_by_ids(keys)['resources']}
+    return [key for key in keys if key not in found]
+
+
+def upload_instructions(request, product_id, ticket, key):
+    """
+    Where the client sends the file: a signed Cloudinary upload, or the API's
+    own upload action in local storage mode. Either way the file bypasses
+    the image API workers' processing path.
+    """
+    if uses_local_storage():
+        url = reverse('product-image-upload', kwargs={'product_pk': product_id})
+        return {'url': request.build_absolute_uri(url), 'fields': {'ticket': ticket}, 'file_field': 'file'}
+
+    config = cloudinary.config()
+    params = {'public_id': key, 'timestamp': int(time.time())}
+    params['signature'] = cloudinary.utils.api_sign_request(params, config.api_secret)
+    params['api_key'] = config.api_key
+    return {'url': cloudinary.utils.cloudinary_api_url('upload'), 'fields': params, 'file_field': 'file'}
@@ -4,6 +4,15 @@ from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from product.models import Product, Category, Review, ProductImage
 from product.serializer import ProductSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer
+from product.serializer import UploadTicketRequestSerializer, FinalizeUploadSerializer
+from product.uploads import make_ticket, read_ticket, upload_instructions
+from product.images import get_image_storage
+from product.validators import validate_file_size
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.conf import settings
+from django.utils import timezone
 from django.db.models import Count
 from rest_framework import status
 from rest_framework.views import APIView
@@ -12,15 +21,17 @@ from rest_framework.generics import RetrieveUpdateDestroyAPIView
 from rest_framework.viewsets import ModelViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from product.filter import ProductFilter
+from product.filter import ProductFilter, ReviewFilter, FullTextSearchFilter
+from product.cache import CachedResponseMixin
 from rest_framework.pagination import PageNumberPagination
-from product.pagination import DefaultPagination
+from product.pagination import DefaultPagination, ProductCursorPagination, ReviewCursorPagination
 from rest_framework.permissions import IsAdminUser, AllowAny, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly
 from api.permissions import IsAdminOrReadOnly, FullDjangoModelClass
+from api.db import ReplicaReadsMixin, StatementTimeoutMixin
 from product.permissions import IsAdminOrIsAuthon
 from drf_yasg.utils import swagger_auto_schema
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ReplicaReadsMixin, CachedResponseMixin, StatementTimeoutMixin, ModelViewSet):
     """
     - Retrive All Product
     - Create Product --> Admin Only
@@ -30,17 +41,36 @@ class ProductViewSet(ModelViewSet):
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     # pagination_class = PageNumberPagination
     pagination_class = DefaultPagination
     search_fields = ['name', 'description']
-    ordering_fields = ['price', 'updated_at']
+    ordering_fields = ['price', 'updated_at', 'rating_avg', 'rating_count']
     # permission_classes = [IsAdminUser]
     permission_classes = [IsAdminOrReadOnly]
+    statement_timeout = settings.CATALOG_STATEMENT_TIMEOUT
+    replica_reads = True
+    cache_dependencies = [Product, ProductImage, Category]  # category: ?expand=category and tax_rate
+
+    @property
+    def paginator(self):
+        # ?pagination=cursor (or an existing ?cursor=) switches to keyset pagination
+        if not hasattr(self, '_paginator'):
+            params = getattr(self.request, 'query_params', {})
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
-        return Product.objects.prefetch_related('images').all()
+        # ?fields= / ?expand= decide which columns and relations are loaded
+        ordering = [name.lstrip('-') for name in self.request.query_params.get('ordering', '').split(',')]
+        return ProductSerializer.optimize_queryset(
+            Product.objects.all(), self.request,
+            extra_columns=[name for name in ordering if name in self.ordering_fields],
+        )
 
     @swagger_auto_schema( #swagger
         operation_summary='To list all product',
@@ -90,21 +120,27 @@ class ProductViewSet(ModelViewSet):
     #         self.perform_destroy(product)
     #         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class CategoryViewSet(ModelViewSet):
-    queryset = Category.objects.annotate(
-        product_count = Count('products')
-    ).all()
+class CategoryViewSet(ReplicaReadsMixin, CachedResponseMixin, StatementTimeoutMixin, ModelViewSet):
+    queryset = Category.objects.all()  # product_count is a stored counter, see CategoryQuerySet
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_dependencies = [Category, Product]
+    statement_timeout = settings.CATALOG_STATEMENT_TIMEOUT
+    replica_reads = True
 
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(ReplicaReadsMixin, StatementTimeoutMixin, ModelViewSet):
     serializer_class = ReviewSerializer
     permission_classes = [IsAdminOrIsAuthon]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ReviewFilter
+    pagination_class = ReviewCursorPagination
+    statement_timeout = settings.CATALOG_STATEMENT_TIMEOUT
+    replica_reads = True
 
     def get_queryset(self):
-        return Review.objects.filter(product_id=self.kwargs.get('product_pk'))
+        return Review.objects.select_related('user').filter(product_id=self.kwargs.get('product_pk'))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -117,17 +153,70 @@ class ReviewViewSet(ModelViewSet):
             'product_id': self.kwargs.get('product_pk'),
         }
 
-class ProductImageViewSet(ModelViewSet):
+class ProductImageViewSet(ReplicaReadsMixin, ModelViewSet):
     serializer_class = ProductImageSerializer
     permission_classes = [IsAdminOrReadOnly]
+    replica_reads = True
 
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs.get('product_pk'))
 
+    def get_serializer_class(self):
+        if self.action == 'tickets':
+            return UploadTicketRequestSerializer
+        if self.action == 'finalize':
+            return FinalizeUploadSerializer
+        return ProductImageSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['product_id'] = self.kwargs.get('product_pk')
+        return context
+
+    def get_product(self):
+        return get_object_or_404(Product.objects.only('id'), pk=self.kwargs.get('product_pk'))
+
     def perform_create(self, serializer):
-        product_id = self.kwargs.get('product_pk')
-        product = Product.objects.get(pk=product_id)
-        serializer.save(product=product)
+        serializer.save(product=self.get_product())
+
+    @action(detail=False, methods=['post'])
+    def tickets(self, request, product_pk=None):
+        """Step 1 of a direct upload: one short-lived ticket per file, with where to send it."""
+        product = self.get_product()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        expires_at = timezone.now() + settings.PRODUCT_IMAGE_TICKET_TTL
+        tickets = []
+        for _ in range(serializer.validated_data['count']):
+            ticket, key = make_ticket(product.pk)
+            tickets.append({'ticket': ticket, 'expires_at': expires_at, 'upload': upload_instructions(request, product.pk, ticket, key)})
+        return Response({'tickets': tickets}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], permission_classes=[AllowAny], parser_classes=[MultiPartParser])
+    def upload(self, request, product_pk=None):
+        """Step 2 in local storage mode; the signed ticket is the credential."""
+        key = read_ticket(request.data.get('ticket', ''), product_pk)
+        upload = request.FILES.get('file')
+        if key is None or upload is None:
+            return Response({'Error': 'A valid ticket and file are required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            validate_file_size(upload)
+        except DjangoValidationError as e:
+            return Response({'Error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        storage = get_image_storage()
+        storage.delete(key)
+        storage.save(key, upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'])
+    def finalize(self, request, product_pk=None):
+        """Step 3: register the uploaded files; they turn `ready` once processed."""
+        self.get_product()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        images = serializer.save()
+        data = ProductImageSerializer(images, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
 
 """ This are store for using next time as a documentation
 
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# what the API reads off request.user; anything else is loaded on access
+SNAPSHOT_FIELDS = (
+    'id', 'email', 'password', 'first_name', 'last_name', 'phone_number', 'address',
+    'is_staff', 'is_superuser', 'is_active',
+)
+
+
+class UserSnapshotCache:
+    """
+    Bounded LRU of user field values with a TTL, per process. Signals drop
+    an entry when the user is saved here; the TTL bounds how long other
+    processes can serve a stale snapshot.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def get(self, user_id):
+        user_id = str(user_id)  # token claims carry the id as a string
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            expires, values = entry
+            if expires < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return values
+
+    def set(self, user_id, values, generation):
+        user_id = str(user_id)
+        with self.lock:
+            if generation != self.generation:
+                return  # invalidated while the row was being read
+            self.entries[user_id] = (time.monotonic() + self.ttl, values)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+user_cache = UserSnapshotCache(
+    max_size=settings.JWT_USER_CACHE['MAX_SIZE'],
+    ttl=settings.JWT_USER_CACHE['TTL'],
+)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the token's user from `user_cache` instead of a query per request."""
+
+    @cached_property
+    def snapshot_fields(self):
+        # model field order, which Model.from_db() expects for a partial row
+        return [field.attname for field in self.user_model._meta.concrete_fields if field.attname in SNAPSHOT_FIELDS]
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        users = self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+        values = user_cache.get(user_id)
+        if values is None:
+            generation = user_cache.generation
+            values = users.values_list(*self.snapshot_fields).first()
+            if values is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            user_cache.set(user_id, values, generation)
+
+        # a fresh instance per request, views may change it
+        user = self.user_model.from_db(users.db, self.snapshot_fields, values)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
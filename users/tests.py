@@ -1,3 +1,37 @@
+from unittest.mock import patch
 from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from users.authentication import user_cache
+from users.models import User
 
-# Create your tests here.
+
+class CachedJWTAuthenticationTests(TestCase):
+    url = '/api/v1/orders/'
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(email='buyer@example.com', password='secret-pass', first_name='Buyer')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+
+    def test_user_is_loaded_once(self):
+        with self.assertNumQueries(2):  # user + empty order page count
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_saving_the_user_drops_the_snapshot(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        with patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            self.user.set_password('another-pass')
+            self.user.save()
+            self.assertEqual(self.client.get(self.url).status_code, 401)